@@ -0,0 +1,76 @@
+import asyncio
+import inspect
+
+from MessageProcessor import upper
+
+
+class AsyncMessageProcessor:
+    # Runs N consumer tasks against an AsyncMessageQueue. The handler may be
+    # a plain function or a coroutine function.
+    def __init__(self, queue, handler=upper, workers=1):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.processed_messages = []
+        self.errors = []
+        self.tasks = []
+
+    async def _handle(self, message):
+        result = self.handler(message)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def process_next(self):
+        # Checking the length first tells an empty queue from a queued None;
+        # nothing can run in between since there is no await.
+        if not len(self.queue):
+            return False
+        message = self.queue.get_next_message()
+        self.queue.task_done()
+        if not message:
+            return False
+        self.processed_messages.append(await self._handle(message))
+        return True
+
+    async def process_all(self):
+        count = 0
+        while await self.process_next():
+            count += 1
+        return count
+
+    def start(self, workers=None):
+        if self.tasks:
+            raise RuntimeError("AsyncMessageProcessor is already running")
+        self.tasks = [asyncio.ensure_future(self._work()) for _ in range(workers or self.workers)]
+        return True
+
+    async def _work(self):
+        # Falsy messages are skipped, as no single consumer owns the queue.
+        while True:
+            message = await self.queue.get()
+            try:
+                if message:
+                    self.processed_messages.append(await self._handle(message))
+            except Exception as exc:
+                self.errors.append((message, exc))
+            finally:
+                self.queue.task_done()
+
+    async def stop(self, drain=True):
+        # With drain the consumers first finish everything already queued;
+        # without it they are cancelled at their next await.
+        if drain:
+            await self.queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        return True
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
@@ -0,0 +1,61 @@
+import asyncio
+
+
+class AsyncMessageQueue:
+    # The asyncio counterpart of MessageQueue. With a maxsize, put()
+    # suspends producers while the queue is full instead of letting it grow.
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self.queue = asyncio.Queue(maxsize)
+
+    def __len__(self):
+        return self.queue.qsize()
+
+    def full(self):
+        return self.queue.full()
+
+    async def put(self, message):
+        await self.queue.put(message)
+        return True
+
+    def add_message(self, message):
+        # Never waits: returns False when the queue is full.
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def get(self, timeout=None):
+        # Returns None if no message arrives within timeout seconds.
+        if timeout is None:
+            return await self.queue.get()
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def get_next_message(self):
+        try:
+            return self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+    def get_messages(self, max_n):
+        batch = []
+        get_nowait = self.queue.get_nowait
+        try:
+            for _ in range(max_n):
+                batch.append(get_nowait())
+        except asyncio.QueueEmpty:
+            pass
+        return batch
+
+    def task_done(self, n=1):
+        # Consumers mark each message they took as done so join() can tell
+        # when everything queued has been handled.
+        for _ in range(n):
+            self.queue.task_done()
+
+    async def join(self):
+        await self.queue.join()
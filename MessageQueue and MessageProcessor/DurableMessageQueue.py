@@ -0,0 +1,213 @@
+import json
+import os
+import struct
+import threading
+import zlib
+
+from MessageQueue import MessageQueue
+
+# payload length, then the crc32 of the JSON payload.
+RECORD = struct.Struct("<II")
+OFFSET_FILE = "offset"
+encode = json.JSONEncoder().encode
+
+
+class DurableMessageQueue(MessageQueue):
+    # A MessageQueue whose messages are also appended to segmented log files
+    # in directory, so that whatever was not consumed survives a restart.
+    #
+    # Every record is flushed to the OS as it is added, so only a machine
+    # crash can lose it. Writes are group-committed: the log is fsynced once
+    # sync_every messages have accumulated, by a background thread every
+    # sync_interval seconds, or on sync() and close(); a sync_interval of 0
+    # fsyncs on every add instead. The consumer offset is committed along
+    # with it, so after a crash messages taken since the last sync are
+    # delivered again.
+    # Messages must be JSON-serialisable and come back from a replay as
+    # their JSON decoding.
+    def __init__(self, directory, segment_size=64 << 20, sync_every=1000, sync_interval=0.05):
+        super().__init__()
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        self.committed = self._read_offset()
+        # (first sequence number, path) of every live segment, oldest first.
+        self.segments = []
+        self.next_sequence = self.committed
+        self._replay()
+        self.file = None
+        self._open_segment()
+        self.closed = threading.Event()
+        if sync_interval:
+            self.syncer = threading.Thread(target=self._sync_loop, daemon=True)
+            self.syncer.start()
+        else:
+            self.syncer = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_offset(self):
+        try:
+            with open(self._path(OFFSET_FILE)) as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return 0
+
+    def _replay(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".log"))
+        for name in names:
+            path = self._path(name)
+            sequence = int(name[:-4])
+            with open(path, "rb") as f:
+                data = f.read()
+            position = 0
+            while position + RECORD.size <= len(data):
+                length, crc = RECORD.unpack_from(data, position)
+                payload = data[position + RECORD.size:position + RECORD.size + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                if sequence >= self.committed:
+                    self._messages.append(json.loads(payload))
+                sequence += 1
+                position += RECORD.size + length
+            if position < len(data):
+                # A torn write from a crash; later appends must not follow it.
+                with open(path, "r+b") as f:
+                    f.truncate(position)
+            self.segments.append((int(name[:-4]), path))
+            self.next_sequence = max(self.next_sequence, sequence)
+
+    def _open_segment(self):
+        if self.segments and self.segments[-1][0] == self.next_sequence:
+            path = self.segments[-1][1]
+        else:
+            path = self._path("%020d.log" % self.next_sequence)
+            self.segments.append((self.next_sequence, path))
+        self.file = open(path, "ab")
+        # Tracked here because file.tell() costs more than the write itself.
+        self.segment_bytes = self.file.tell()
+
+    def _rotate(self):
+        self._sync()
+        self.file.close()
+        self._open_segment()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self._commit_offset()
+
+    def _sync_loop(self):
+        while not self.closed.wait(self.sync_interval):
+            with self.lock:
+                if self.file is None:
+                    return
+                if self.unsynced or self.next_sequence - len(self._messages) != self.committed:
+                    self._sync()
+
+    def _commit_offset(self):
+        # Messages still queued are exactly the newest ones in the log, so
+        # everything before them has been consumed.
+        offset = self.next_sequence - len(self._messages)
+        if offset == self.committed:
+            return
+        tmp_path = self._path(OFFSET_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path(OFFSET_FILE))
+        # A segment goes only once this commit and the one before it have
+        # both passed it, so messages handed back (see requeue_messages)
+        # within a sync interval of being taken can still be replayed.
+        removable = min(self.committed, offset)
+        self.committed = offset
+        while len(self.segments) > 1 and self.segments[1][0] <= removable:
+            os.remove(self.segments.pop(0)[1])
+
+    def sync(self):
+        with self.lock:
+            if self.file is not None:
+                self._sync()
+        return True
+
+    def close(self):
+        self.closed.set()
+        if self.syncer is not None and self.syncer is not threading.current_thread():
+            self.syncer.join()
+        with self.lock:
+            if self.file is not None:
+                self._sync()
+                self.file.close()
+                self.file = None
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_message(self, message, priority=0, deliver_at=None):
+        # The log replays in FIFO order and the consumer offset assumes it.
+        if priority or deliver_at is not None:
+            raise ValueError("DurableMessageQueue does not support priorities or delayed delivery")
+        payload = encode(message).encode("utf-8")
+        record = RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            self.file.write(record)
+            self.file.flush()
+            self.segment_bytes += len(record)
+            self.next_sequence += 1
+            self._messages.append(message)
+            self.unsynced += 1
+            if self.segment_bytes >= self.segment_size:
+                self._rotate()
+            elif self.unsynced >= self.sync_every or not self.sync_interval:
+                self._sync()
+        self._notify()
+        return True
+
+    def _consumed(self):
+        # The syncer commits the offset every sync_interval; without one,
+        # every take commits it.
+        if self.syncer is None and self.file is not None:
+            self.sync()
+
+    def get_next_message(self):
+        message = super().get_next_message()
+        self._consumed()
+        return message
+
+    def get(self, timeout=None):
+        message = super().get(timeout)
+        self._consumed()
+        return message
+
+    def get_messages(self, max_n):
+        messages = super().get_messages(max_n)
+        self._consumed()
+        return messages
+
+    def requeue_messages(self, messages):
+        # A sync while the messages were out may have committed past them;
+        # the offset is moved back at once so a restart delivers them again.
+        super().requeue_messages(messages)
+        with self.lock:
+            if self.file is not None and self.next_sequence - len(self._messages) < self.committed:
+                self._commit_offset()
+        return True
+
+    def receive(self, visibility_timeout=30.0, timeout=0):
+        # The committed offset counts every message taken as consumed, so it
+        # cannot hold back unacked ones.
+        raise ValueError("DurableMessageQueue does not support leases")
+
+    def receive_messages(self, max_n, visibility_timeout=30.0):
+        raise ValueError("DurableMessageQueue does not support leases")
@@ -1,17 +1,198 @@
+import threading
+
+
+def upper(message):
+    return message.upper()
+
+
 class MessageProcessor:
-    def __init__(self, queue):
+    def __init__(self, queue, handler=upper, workers=1, poll_interval=0.05, ack=False,
+                 visibility_timeout=30.0, batch_handler=None):
         self.queue = queue
+        # The handler's return value is what ends up in processed_messages.
+        self.handler = handler
+        # When set, process_batch and process_all(batch_size) pass each batch
+        # to batch_handler(messages) in one call and extend processed_messages
+        # with the results it returns; one message at a time still goes
+        # through handler.
+        self.batch_handler = batch_handler
+        # In ack mode messages are leased rather than popped and only acked
+        # once handled, so one whose handler raises or never returns comes
+        # back after visibility_timeout seconds.
+        self.ack = ack
+        self.visibility_timeout = visibility_timeout
+        self.workers = workers
+        self.poll_interval = poll_interval
         self.processed_messages = []
+        # Worker threads append under this lock; messages whose handler
+        # raised are kept with the exception in errors.
+        self.lock = threading.Lock()
+        self.errors = []
+        self.threads = []
+        self.stopping = threading.Event()
+        self.draining = threading.Event()
         
     def process_next(self):
+        if self.ack:
+            return self._process_leased()
         message = self.queue.get_next_message()
         if message:
-            self.processed_messages.append(message.upper())
+            self.processed_messages.append(self.handler(message))
             return True
         return False
+
+    def _process_leased(self):
+        lease = self.queue.receive(self.visibility_timeout)
+        if lease is None:
+            return False
+        lease_id, message = lease
+        if not message:
+            self.queue.ack(lease_id)
+            return False
+        self.processed_messages.append(self.handler(message))
+        self.queue.ack(lease_id)
+        return True
+
+    def _take(self, n):
+        if self.ack:
+            return self.queue.receive_messages(n, self.visibility_timeout)
+        return self.queue.get_messages(n)
+
+    def _give_back(self, items):
+        if not self.ack:
+            self.queue.requeue_messages(items)
+            return
+        # Released last to first, so the first ends up at the head again.
+        for lease_id, _ in reversed(items):
+            self.queue.release(lease_id)
+
+    def _process_messages(self, items):
+        # Returns how many messages were processed and whether a falsy message
+        # stopped processing, just as it stops process_all. Messages after the
+        # stopping (or failing) one go back to the head of the queue. In ack
+        # mode items are (lease id, message) pairs.
+        if self.batch_handler is not None:
+            return self._process_together(items)
+        append = self.processed_messages.append
+        handler = self.handler
+        ack = self.queue.ack if self.ack else None
+        for i, item in enumerate(items):
+            message = item if ack is None else item[1]
+            if not message:
+                if ack is not None:
+                    ack(item[0])
+                self._give_back(items[i + 1:])
+                return i, True
+            try:
+                append(handler(message))
+            except Exception:
+                self._give_back(items[i + 1:])
+                raise
+            if ack is not None:
+                ack(item[0])
+        return len(items), False
+
+    def _process_together(self, items):
+        # As _process_messages, but the messages before any falsy one go to
+        # batch_handler at once. Which message it failed on is unknown, so if
+        # it raises the whole batch goes back.
+        ack = self.queue.ack if self.ack else None
+        messages = items if ack is None else [message for _, message in items]
+        end = next((i for i, message in enumerate(messages) if not message), len(items))
+        if end:
+            try:
+                results = self.batch_handler(messages[:end])
+            except Exception:
+                self._give_back(items)
+                raise
+            self.processed_messages.extend(results)
+        if ack is not None:
+            for lease_id, _ in items[:end + 1]:
+                ack(lease_id)
+        if end < len(items):
+            self._give_back(items[end + 1:])
+            return end, True
+        return end, False
+
+    def process_batch(self, n):
+        return self._process_messages(self._take(n))[0]
         
-    def process_all(self):
+    def process_all(self, batch_size=None):
+        # Without a batch size messages are pulled one at a time, which works
+        # with any queue that provides get_next_message.
         count = 0
-        while self.process_next():
-            count += 1
-        return count
\ No newline at end of file
+        if batch_size is None:
+            while self.process_next():
+                count += 1
+            return count
+        while True:
+            messages = self._take(batch_size)
+            processed, stopped = self._process_messages(messages)
+            count += processed
+            if stopped or not messages:
+                return count
+
+    def start(self, workers=None):
+        # Runs the handler on a pool of threads that block on queue.get until
+        # stop() is called. Falsy messages are skipped rather than ending
+        # processing, as no single worker owns the queue.
+        if self.threads:
+            raise RuntimeError("MessageProcessor is already running")
+        self.stopping.clear()
+        self.draining.clear()
+        self.threads = [threading.Thread(target=self._work, name="MessageProcessor-%d" % i, daemon=True)
+                        for i in range(workers or self.workers)]
+        for thread in self.threads:
+            thread.start()
+        return True
+
+    def _work(self):
+        queue = self.queue
+        handler = self.handler
+        while not self.stopping.is_set():
+            lease_id = None
+            if self.ack:
+                lease = queue.receive(self.visibility_timeout, self.poll_interval)
+                if lease is not None:
+                    lease_id, message = lease
+                    if not message:
+                        queue.ack(lease_id)
+                        continue
+                else:
+                    message = None
+            else:
+                message = queue.get(timeout=self.poll_interval)
+            if not message:
+                if message is None and self.draining.is_set():
+                    return
+                continue
+            try:
+                result = handler(message)
+            except Exception as exc:
+                # Unacked, the message is redelivered once its lease expires.
+                with self.lock:
+                    self.errors.append((message, exc))
+                continue
+            with self.lock:
+                self.processed_messages.append(result)
+            if lease_id is not None:
+                queue.ack(lease_id)
+
+    def stop(self, drain=True, timeout=None):
+        # With drain the workers finish every message already due; without
+        # it they stop after their current message. Returns whether every
+        # worker exited within timeout.
+        (self.draining if drain else self.stopping).set()
+        for thread in self.threads:
+            thread.join(timeout)
+        stopped = not any(thread.is_alive() for thread in self.threads)
+        if stopped:
+            self.threads = []
+        return stopped
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
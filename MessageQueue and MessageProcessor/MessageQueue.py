@@ -1,13 +1,233 @@
+import threading
+import time
+from collections import deque
+from heapq import heapify, heappop, heappush
+from itertools import count
+
+
 class MessageQueue:
     def __init__(self):
-        self.messages = []
-        
-    def add_message(self, message):
-        self.messages.append(message)
+        self.messages = deque()
+        # Appends and pops on a deque are atomic, so only blocking consumers
+        # take the lock; producers notify through it only when one waits.
+        self.not_empty = threading.Condition(threading.Lock())
+        self.waiting = 0
+        # Messages with a priority wait in a heap of (-priority, sequence,
+        # message), and those not yet due in one of (deliver_at, sequence,
+        # priority, message). Both are only touched with the lock held; plain
+        # FIFO messages never leave the deque.
+        self.prioritized = []
+        self.delayed = []
+        self.sequence = count()
+        # Leased messages, invisible until acked or until their lease
+        # expires: lease id -> (expires_at, priority, message), plus a heap
+        # of (expires_at, lease id). Acked and released leases leave stale
+        # heap entries behind, which are skipped when they surface.
+        self.leases = {}
+        self.expiries = []
+        self.lease_ids = count(1)
+
+    @property
+    def messages(self):
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages):
+        # Whatever is assigned is kept in a deque so that dequeuing stays O(1).
+        self._messages = messages if type(messages) is deque else deque(messages)
+
+    def _notify(self, n=1):
+        if self.waiting:
+            with self.not_empty:
+                self.not_empty.notify(n)
+
+    def add_message(self, message, priority=0, deliver_at=None):
+        # Higher priorities are delivered first and equal ones in FIFO order;
+        # deliver_at is a time.time() timestamp before which the message is
+        # held back.
+        if not priority and deliver_at is None:
+            self._messages.append(message)
+            self._notify()
+            return True
+        with self.not_empty:
+            if deliver_at is not None and deliver_at > time.time():
+                heappush(self.delayed, (deliver_at, next(self.sequence), priority, message))
+            elif priority:
+                heappush(self.prioritized, (-priority, next(self.sequence), message))
+            else:
+                self._messages.append(message)
+            # Waiting consumers may need to shorten their wait for the new
+            # earliest deadline, so they are all woken.
+            self.not_empty.notify_all()
         return True
-        
+
+    def _release_due(self):
+        delayed = self.delayed
+        now = time.time()
+        while delayed and delayed[0][0] <= now:
+            _, sequence, priority, message = heappop(delayed)
+            if priority:
+                heappush(self.prioritized, (-priority, sequence, message))
+            else:
+                self._messages.append(message)
+        expiries = self.expiries
+        now = time.monotonic()
+        due = []
+        while expiries and expiries[0][0] <= now:
+            lease_id = heappop(expiries)[1]
+            if lease_id in self.leases:
+                due.append(lease_id)
+        # Each redelivery goes in front of the last, so leases that expire
+        # together are put back newest first to come out in the order they
+        # were received.
+        for lease_id in sorted(due, reverse=True):
+            lease = self.leases.pop(lease_id)
+            self._redeliver(lease[2], lease[1])
+
+    def _redeliver(self, message, priority):
+        # A message coming back from a lease goes to the front of its
+        # priority, as it was due before anything queued since.
+        if priority:
+            heappush(self.prioritized, (-priority, -next(self.sequence), message))
+        else:
+            self._messages.appendleft(message)
+
+    def _pop(self):
+        # Called with the lock held; returns whether a due message was found,
+        # the message and its priority. Positive priorities go before the
+        # FIFO deque and negative ones after it.
+        if self.delayed or self.expiries:
+            self._release_due()
+        prioritized = self.prioritized
+        if prioritized and (prioritized[0][0] < 0 or not self._messages):
+            entry = heappop(prioritized)
+            return True, entry[2], -entry[0]
+        try:
+            return True, self._messages.popleft(), 0
+        except IndexError:
+            if prioritized:
+                entry = heappop(prioritized)
+                return True, entry[2], -entry[0]
+            return False, None, 0
+
+    def _next_due(self):
+        # Seconds until the earliest delayed message is due or lease
+        # expires, or None.
+        due = None
+        if self.delayed:
+            due = max(0.0, self.delayed[0][0] - time.time())
+        if self.expiries:
+            expiry = max(0.0, self.expiries[0][0] - time.monotonic())
+            due = expiry if due is None else min(due, expiry)
+        return due
+
     def get_next_message(self):
-        if self.messages:
-            return self.messages.pop(0)
-        return None
+        if not (self.prioritized or self.delayed or self.expiries):
+            try:
+                return self._messages.popleft()
+            except IndexError:
+                return None
+        with self.not_empty:
+            return self._pop()[1]
 
+    def get(self, timeout=None):
+        # Blocks until a message is due; returns None if none is within
+        # timeout seconds.
+        with self.not_empty:
+            return self._wait(timeout)[1]
+
+    def _wait(self, timeout):
+        # Called with the lock held; _pop, waiting up to timeout seconds. A
+        # consumer counts as waiting before it first looks at the queue, so
+        # a producer can never miss it.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.waiting += 1
+        try:
+            while True:
+                popped = self._pop()
+                if popped[0]:
+                    return popped
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return popped
+                due = self._next_due()
+                if due is not None and (remaining is None or due < remaining):
+                    remaining = due
+                self.not_empty.wait(remaining)
+        finally:
+            self.waiting -= 1
+
+    def get_messages(self, max_n):
+        batch = []
+        append = batch.append
+        if self.prioritized or self.delayed or self.expiries:
+            with self.not_empty:
+                for _ in range(max_n):
+                    found, message, _ = self._pop()
+                    if not found:
+                        break
+                    append(message)
+            return batch
+        popleft = self._messages.popleft
+        try:
+            for _ in range(max_n):
+                append(popleft())
+        except IndexError:
+            pass
+        return batch
+
+    def requeue_messages(self, messages):
+        # Puts messages back at the head of the FIFO messages, in their
+        # original order; any priority they had is not kept.
+        self._messages.extendleft(reversed(messages))
+        self._notify(len(messages))
+        return True
+
+    def _lease(self, message, priority, visibility_timeout):
+        lease_id = next(self.lease_ids)
+        expires_at = time.monotonic() + visibility_timeout
+        self.leases[lease_id] = (expires_at, priority, message)
+        heappush(self.expiries, (expires_at, lease_id))
+        return lease_id, message
+
+    def receive(self, visibility_timeout=30.0, timeout=0):
+        # Like get, but the message is only hidden for visibility_timeout
+        # seconds and comes back unless ack() is called with the returned
+        # lease id in time. Returns (lease id, message), or None.
+        with self.not_empty:
+            found, message, priority = self._wait(timeout)
+            if not found:
+                return None
+            return self._lease(message, priority, visibility_timeout)
+
+    def receive_messages(self, max_n, visibility_timeout=30.0):
+        batch = []
+        with self.not_empty:
+            for _ in range(max_n):
+                found, message, priority = self._pop()
+                if not found:
+                    break
+                batch.append(self._lease(message, priority, visibility_timeout))
+        return batch
+
+    def ack(self, lease_id):
+        # Removes a leased message for good; False if the lease had already
+        # expired (the message may then be delivered again) or been acked.
+        with self.not_empty:
+            if self.leases.pop(lease_id, None) is None:
+                return False
+            # Keeps stale heap entries from outgrowing the live leases.
+            if len(self.expiries) > 64 and len(self.expiries) > 2 * len(self.leases):
+                self.expiries = [(lease[0], lease_id) for lease_id, lease in self.leases.items()]
+                heapify(self.expiries)
+        return True
+
+    def release(self, lease_id):
+        # Makes a leased message visible again right away.
+        with self.not_empty:
+            lease = self.leases.pop(lease_id, None)
+            if lease is None:
+                return False
+            self._redeliver(lease[2], lease[1])
+            self.not_empty.notify()
+        return True
@@ -0,0 +1,225 @@
+import multiprocessing
+import queue as queue_module
+import zlib
+from collections import defaultdict, deque
+from itertools import count
+
+from MessageProcessor import upper
+
+
+def _serve(partition, handler, inputs, results):
+    # Runs in a worker process: handles one partition's batches in arrival
+    # order and answers each with one (partition, results, errors) batch.
+    while True:
+        batch = inputs.get()
+        if batch is None:
+            return
+        handled = []
+        errors = []
+        for key, payload in batch:
+            if not payload:
+                continue
+            try:
+                handled.append((key, handler(payload)))
+            except Exception as exc:
+                errors.append((key, payload, exc))
+        results.put((partition, handled, errors))
+
+
+class PartitionedMessageProcessor:
+    # Spreads messages over worker processes by key. Every message with a
+    # given key goes to the same process and is handled in queue order, so
+    # per-key ordering holds while different keys run on different cores.
+    #
+    # Messages are (key, payload) pairs unless key is given, in which case
+    # key(message) picks the key and the whole message is the payload. The
+    # handler runs in the workers and so must be picklable, e.g. a module
+    # level function. Results come back through one channel holding at most
+    # result_capacity batches, and each partition accepts at most
+    # in_flight batches, so a slow consumer throttles the whole pipeline.
+    #
+    # If results() is abandoned early or a worker dies, the workers are
+    # stopped and every message not yet answered goes back to the head of
+    # the queue in queue order. A batch a worker finished just before being
+    # stopped can therefore be handled twice.
+    def __init__(self, queue, handler=upper, partitions=None, key=None, batch_size=256,
+                 result_capacity=64, in_flight=4, poll_interval=0.05):
+        self.queue = queue
+        self.handler = handler
+        self.partitions = partitions or multiprocessing.cpu_count()
+        self.key = key
+        self.batch_size = batch_size
+        self.result_capacity = result_capacity
+        self.in_flight = in_flight
+        # How often a blocked dispatch or collect checks the workers.
+        self.poll_interval = poll_interval
+        self.processed_messages = []
+        self.errors = []
+        self.inputs = []
+        self.processes = []
+        self.results_channel = None
+        # partition -> (sequence, message) lists of the batches dispatched to
+        # it and not yet answered, oldest first.
+        self.pending = {}
+        self.sequence = count()
+        # (key, result) pairs answered but not yet yielded, e.g. the rest of
+        # a batch when results() is abandoned mid-batch; the next results()
+        # yields them first.
+        self.ready = deque()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        if self.processes:
+            raise RuntimeError("PartitionedMessageProcessor is already running")
+        self.results_channel = multiprocessing.Queue(self.result_capacity)
+        self.inputs = [multiprocessing.Queue(self.in_flight) for _ in range(self.partitions)]
+        self.pending = {partition: deque() for partition in range(self.partitions)}
+        self.processes = [multiprocessing.Process(target=_serve,
+                                                  args=(partition, self.handler, inputs, self.results_channel),
+                                                  daemon=True)
+                          for partition, inputs in enumerate(self.inputs)]
+        for process in self.processes:
+            process.start()
+        return True
+
+    def stop(self, timeout=None):
+        # Workers exit once they have answered everything they were given. A
+        # results() left suspended with batches outstanding is abandoned.
+        if any(self.pending.values()):
+            self._abandon()
+        for inputs, process in zip(self.inputs, self.processes):
+            try:
+                inputs.put_nowait(None)
+            except queue_module.Full:
+                process.terminate()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._close()
+        return True
+
+    def _close(self):
+        # Nothing more will be read from these, so exiting must not wait for
+        # their feeder threads to flush.
+        for channel in self.inputs + [self.results_channel]:
+            if channel is not None:
+                channel.cancel_join_thread()
+                channel.close()
+        self.inputs = []
+        self.processes = []
+        self.results_channel = None
+        self.pending = {}
+
+    def _abandon(self, undispatched=()):
+        # Stops the workers where they are and hands back, in queue order,
+        # every message taken from the queue and not yet answered.
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        unfinished = list(undispatched)
+        for batches in self.pending.values():
+            for originals in batches:
+                unfinished.extend(originals)
+        unfinished.sort(key=lambda item: item[0])
+        self._close()
+        if unfinished:
+            self.queue.requeue_messages([message for _, message in unfinished])
+
+    def _check_workers(self):
+        for partition, process in enumerate(self.processes):
+            if not process.is_alive():
+                raise RuntimeError("worker for partition %d exited with code %s" % (partition, process.exitcode))
+
+    def partition_for(self, key):
+        # crc32 rather than hash() keeps placement stable across processes
+        # and runs.
+        return zlib.crc32(repr(key).encode("utf-8")) % self.partitions
+
+    def _route(self, messages):
+        # partition -> (batch for the worker, the (sequence, message) pairs
+        # it was made from).
+        routed = defaultdict(lambda: ([], []))
+        key = self.key
+        sequence = self.sequence
+        for message in messages:
+            if key is None:
+                message_key, payload = message
+            else:
+                message_key, payload = key(message), message
+            batch, originals = routed[self.partition_for(message_key)]
+            batch.append((message_key, payload))
+            originals.append((next(sequence), message))
+        return routed
+
+    def _collect(self, block):
+        while True:
+            try:
+                partition, handled, errors = self.results_channel.get(block, self.poll_interval)
+                break
+            except queue_module.Empty:
+                if not block:
+                    return None
+                self._check_workers()
+        self.pending[partition].popleft()
+        self.errors.extend(errors)
+        return handled
+
+    def _deliver(self, handled):
+        ready = self.ready
+        ready.extend(handled)
+        while ready:
+            yield ready.popleft()
+
+    def results(self):
+        # Dispatches everything queued and yields (key, result) pairs as the
+        # workers finish them. Results are read whenever a partition is
+        # full, so dispatching and collecting never wait on each other.
+        if not self.processes:
+            raise RuntimeError("PartitionedMessageProcessor is not running")
+        yield from self._deliver(())
+        # Batches taken from the queue but not yet handed to a worker.
+        routed = deque()
+        try:
+            while True:
+                messages = self.queue.get_messages(self.batch_size)
+                if not messages:
+                    break
+                routed.extend(self._route(messages).items())
+                while routed:
+                    partition, (batch, originals) = routed[0]
+                    while True:
+                        try:
+                            self.inputs[partition].put(batch, timeout=self.poll_interval)
+                            break
+                        except queue_module.Full:
+                            self._check_workers()
+                            handled = self._collect(False)
+                            if handled is not None:
+                                yield from self._deliver(handled)
+                    self.pending[partition].append(originals)
+                    routed.popleft()
+                while True:
+                    handled = self._collect(False)
+                    if handled is None:
+                        break
+                    yield from self._deliver(handled)
+            while any(self.pending.values()):
+                yield from self._deliver(self._collect(True))
+        finally:
+            if self.processes and (routed or any(self.pending.values())):
+                self._abandon(item for _, (_, originals) in routed for item in originals)
+
+    def process_all(self):
+        count = 0
+        for _, result in self.results():
+            self.processed_messages.append(result)
+            count += 1
+        return count
@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from AsyncMessageProcessor import AsyncMessageProcessor
+from AsyncMessageQueue import AsyncMessageQueue
+from DurableMessageQueue import DurableMessageQueue
+from MessageProcessor import MessageProcessor
+from MessageQueue import MessageQueue
+from PartitionedMessageProcessor import PartitionedMessageProcessor
+
+
+class ListQueue(MessageQueue):
+    # The previous list-backed queue, kept to show the quadratic drain.
+    def __init__(self):
+        super().__init__()
+        self._messages = []
+
+    def get_next_message(self):
+        if self._messages:
+            return self._messages.pop(0)
+        return None
+
+
+def bench_drain(sizes=(10000, 100000, 1000000), list_limit=200000):
+    for size in sizes:
+        for name, queue_class in (("deque", MessageQueue), ("list", ListQueue)):
+            if queue_class is ListQueue and size > list_limit:
+                continue
+            queue = queue_class()
+            for i in range(size):
+                queue.add_message("message %d" % i)
+            processor = MessageProcessor(queue)
+            start = time.perf_counter()
+            processed = processor.process_all()
+            elapsed = time.perf_counter() - start
+            assert processed == size
+            print("drain %8d messages (%-5s): %8.3fs  %10.0f msgs/s" % (size, name, elapsed, size / elapsed))
+
+
+def bench_batch_drain(size=1000000, batch_sizes=(None, 16, 256, 4096)):
+    for batch_size in batch_sizes:
+        queue = MessageQueue()
+        for i in range(size):
+            queue.add_message("message %d" % i)
+        processor = MessageProcessor(queue)
+        start = time.perf_counter()
+        processed = processor.process_all(batch_size)
+        elapsed = time.perf_counter() - start
+        assert processed == size
+        print("drain %8d messages, batch %-5s: %8.3fs  %10.0f msgs/s"
+              % (size, batch_size or 1, elapsed, size / elapsed))
+
+
+def sleepy_upper(message, delay=0.001):
+    # Stands in for a handler doing I/O: sleeping releases the GIL.
+    time.sleep(delay)
+    return message.upper()
+
+
+def bench_worker_scaling(size=2000, workers=(1, 2, 4, 8, 16)):
+    baseline = None
+    for count in workers:
+        queue = MessageQueue()
+        for i in range(size):
+            queue.add_message("message %d" % i)
+        processor = MessageProcessor(queue, handler=sleepy_upper, workers=count)
+        start = time.perf_counter()
+        processor.start()
+        processor.stop(drain=True)
+        elapsed = time.perf_counter() - start
+        assert len(processor.processed_messages) == size
+        baseline = baseline or elapsed
+        print("workers %2d, %d messages with 1ms I/O: %7.3fs  %8.0f msgs/s  speedup %5.2fx"
+              % (count, size, elapsed, size / elapsed, baseline / elapsed))
+
+
+async def _async_run(size, workers, maxsize):
+    async def handler(message):
+        await asyncio.sleep(0.001)
+        return message.upper()
+
+    queue = AsyncMessageQueue(maxsize)
+    peak = 0
+    start = time.perf_counter()
+    async with AsyncMessageProcessor(queue, handler, workers) as processor:
+        for i in range(size):
+            await queue.put("message %d" % i)
+            peak = max(peak, len(queue))
+    elapsed = time.perf_counter() - start
+    assert len(processor.processed_messages) == size
+    return elapsed, peak
+
+
+def bench_async_consumers(size=5000, workers=(1, 8, 64), maxsize=100):
+    # The producer is far faster than the consumers, so the queue sits at
+    # maxsize and the producer is suspended rather than buffering it all.
+    for count in workers:
+        elapsed, peak = asyncio.run(_async_run(size, count, maxsize))
+        print("async %2d consumers, %d messages with 1ms I/O: %7.3fs  %8.0f msgs/s  peak queue %d/%d"
+              % (count, size, elapsed, size / elapsed, peak, maxsize))
+
+
+def bench_durable(size=200000):
+    directory = tempfile.mkdtemp()
+    try:
+        for name, make_queue in (("memory", MessageQueue), ("durable", lambda: DurableMessageQueue(directory))):
+            queue = make_queue()
+            start = time.perf_counter()
+            for i in range(size):
+                queue.add_message("message %d" % i)
+            enqueued = time.perf_counter() - start
+            processed = MessageProcessor(queue).process_all(256)
+            if name == "durable":
+                queue.close()
+            elapsed = time.perf_counter() - start
+            assert processed == size
+            print("%-7s %d messages: enqueue %8.0f msgs/s, enqueue+drain %8.0f msgs/s"
+                  % (name, size, size / enqueued, size / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_priority(size=200000):
+    rng = random.Random(0)
+    now = time.time()
+    workloads = [
+        ("fifo", [(0, None)] * size),
+        ("priorities", [(rng.randrange(10), None) for _ in range(size)]),
+        ("delayed", [(0, now + 1 + rng.random()) for _ in range(size)]),
+    ]
+    for name, options in workloads:
+        queue = MessageQueue()
+        start = time.perf_counter()
+        for i, (priority, deliver_at) in enumerate(options):
+            queue.add_message("message %d" % i, priority, deliver_at)
+        elapsed = time.perf_counter() - start
+        # Delayed messages all fall due while waiting, which is not timed.
+        time.sleep(max(0.0, now + 2 - time.time()) if name == "delayed" else 0)
+        start = time.perf_counter()
+        processed = MessageProcessor(queue).process_all()
+        elapsed += time.perf_counter() - start
+        assert processed == size
+        print("%-10s %d messages: enqueue+drain %8.0f msgs/s" % (name, size, size / elapsed))
+
+
+def bench_leases(in_flight=(10000, 100000, 1000000)):
+    # Leasing and acking must not slow down as more messages are in flight.
+    for size in in_flight:
+        queue = MessageQueue()
+        for i in range(size):
+            queue.add_message(i)
+        start = time.perf_counter()
+        leases = queue.receive_messages(size)
+        leased = time.perf_counter() - start
+        start = time.perf_counter()
+        for lease_id, _ in leases:
+            queue.ack(lease_id)
+        acked = time.perf_counter() - start
+        print("leases %8d in flight: receive %6.2fus/msg  ack %6.2fus/msg"
+              % (size, leased / size * 1e6, acked / size * 1e6))
+
+
+def burn(message, rounds=200):
+    # A CPU-bound stand-in for real handlers; it holds the GIL throughout.
+    digest = message.encode("utf-8")
+    for _ in range(rounds):
+        digest = hashlib.sha256(digest).digest()
+    return message.upper()
+
+
+def bench_partitions(size=20000, keys=100, partitions=(1, 2, 4, 8)):
+    def fill():
+        queue = MessageQueue()
+        for i in range(size):
+            queue.add_message(("key%d" % (i % keys), "message %d" % i))
+        return queue
+
+    queue = fill()
+    processor = MessageProcessor(queue, handler=lambda message: burn(message[1]))
+    start = time.perf_counter()
+    processor.process_all()
+    baseline = time.perf_counter() - start
+    print("in-process     %d messages: %7.3fs  %8.0f msgs/s" % (size, baseline, size / baseline))
+    for count in partitions:
+        queue = fill()
+        with PartitionedMessageProcessor(queue, handler=burn, partitions=count) as processor:
+            start = time.perf_counter()
+            processed = processor.process_all()
+            elapsed = time.perf_counter() - start
+        assert processed == size
+        print("%d partitions   %d messages: %7.3fs  %8.0f msgs/s  speedup %5.2fx (%d cores)"
+              % (count, size, elapsed, size / elapsed, baseline / elapsed, os.cpu_count()))
+
+
+if __name__ == "__main__":
+    bench_drain()
+    bench_batch_drain()
+    bench_worker_scaling()
+    bench_async_consumers()
+    bench_durable()
+    bench_priority()
+    bench_leases()
+    bench_partitions()
@@ -0,0 +1,44 @@
+import pytest
+
+from MessageProcessor import MessageProcessor
+from MessageQueue import MessageQueue
+
+
+def fill(messages):
+    queue = MessageQueue()
+    for message in messages:
+        queue.add_message(message)
+    return queue
+
+
+@pytest.mark.parametrize("ack", [False, True])
+def test_batch_handler_gets_whole_batches_up_to_a_falsy_message(ack):
+    batches = []
+
+    def upper_all(messages):
+        batches.append(list(messages))
+        return [message.upper() for message in messages]
+
+    queue = fill(["a", "b", "c", "d", "e", "", "f"])
+    processor = MessageProcessor(queue, batch_handler=upper_all, ack=ack)
+    assert processor.process_all(2) == 5
+    assert batches == [["a", "b"], ["c", "d"], ["e"]]
+    assert processor.processed_messages == ["A", "B", "C", "D", "E"]
+    assert list(queue.messages) == ["f"]
+    assert processor.process_batch(5) == 1
+    assert processor.processed_messages[-1] == "F"
+    assert not queue.leases
+
+
+@pytest.mark.parametrize("ack", [False, True])
+def test_failed_batch_goes_back_to_the_queue(ack):
+    def fail(messages):
+        raise ValueError(messages)
+
+    queue = fill(["a", "b", "c"])
+    processor = MessageProcessor(queue, batch_handler=fail, ack=ack)
+    with pytest.raises(ValueError):
+        processor.process_batch(2)
+    assert list(queue.messages) == ["a", "b", "c"]
+    assert processor.processed_messages == []
+    assert not queue.leases
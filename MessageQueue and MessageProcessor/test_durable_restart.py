@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from DurableMessageQueue import DurableMessageQueue
+from MessageProcessor import MessageProcessor
+
+
+def fail_on_b(message):
+    if message == "b":
+        raise ValueError(message)
+    return message.upper()
+
+
+def test_restart_replays_messages_handed_back_after_a_stop(tmp_path):
+    # sync_interval=0 commits on every take, before leftovers are requeued;
+    # the queue is then dropped without close(), as in a crash.
+    queue = DurableMessageQueue(str(tmp_path), sync_interval=0)
+    for message in ["a", "", "b", "c"]:
+        queue.add_message(message)
+    assert MessageProcessor(queue).process_all(4) == 1
+    restarted = DurableMessageQueue(str(tmp_path))
+    assert list(restarted.messages) == ["b", "c"]
+
+
+def test_restart_replays_messages_handed_back_after_a_handler_error(tmp_path):
+    queue = DurableMessageQueue(str(tmp_path), sync_interval=0)
+    for message in ["a", "b", "c"]:
+        queue.add_message(message)
+    with pytest.raises(ValueError):
+        MessageProcessor(queue, handler=fail_on_b).process_all(3)
+    restarted = DurableMessageQueue(str(tmp_path))
+    assert list(restarted.messages) == ["c"]
+
+
+def test_requeued_messages_survive_segment_rotation(tmp_path):
+    queue = DurableMessageQueue(str(tmp_path), segment_size=64, sync_interval=0)
+    for i in range(20):
+        queue.add_message("message %d" % i)
+    taken = queue.get_messages(20)
+    queue.requeue_messages(taken[15:])
+    restarted = DurableMessageQueue(str(tmp_path))
+    assert list(restarted.messages) == taken[15:]
+
+
+def test_restart_keeps_messages_of_an_idle_producer_that_crashed(tmp_path):
+    # The producer goes quiet for a few sync intervals and then dies without
+    # close(); the background syncer must have made its messages durable.
+    producer = textwrap.dedent("""
+        import os, sys, time
+        from DurableMessageQueue import DurableMessageQueue
+        queue = DurableMessageQueue(sys.argv[1], sync_interval=0.05)
+        queue.add_message("first")
+        for i in range(10):
+            queue.add_message("m%d" % i)
+        time.sleep(0.5)
+        os._exit(1)
+    """)
+    result = subprocess.run([sys.executable, "-c", producer, str(tmp_path)],
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 1
+    restarted = DurableMessageQueue(str(tmp_path))
+    assert list(restarted.messages) == ["first"] + ["m%d" % i for i in range(10)]
@@ -0,0 +1,25 @@
+import time
+
+import pytest
+
+from MessageQueue import MessageQueue
+
+
+@pytest.mark.parametrize("priority", [0, 5])
+def test_leases_expiring_together_come_back_in_order(priority):
+    queue = MessageQueue()
+    for message in ["a", "b", "c", "d"]:
+        queue.add_message(message, priority=priority)
+    assert [message for _, message in queue.receive_messages(3, visibility_timeout=0.01)] == ["a", "b", "c"]
+    time.sleep(0.05)
+    assert queue.get_messages(4) == ["a", "b", "c", "d"]
+
+
+def test_released_lease_goes_before_later_messages():
+    queue = MessageQueue()
+    for message in ["a", "b"]:
+        queue.add_message(message)
+    lease_id, message = queue.receive()
+    assert message == "a"
+    queue.release(lease_id)
+    assert queue.get_messages(2) == ["a", "b"]
@@ -0,0 +1,56 @@
+import os
+import time
+
+import pytest
+
+from MessageQueue import MessageQueue
+from PartitionedMessageProcessor import PartitionedMessageProcessor
+
+
+def slow_upper(message):
+    time.sleep(0.001)
+    return message.upper()
+
+
+def exit_on_crash(message):
+    if message == "crash":
+        os._exit(3)
+    return message.upper()
+
+
+def fill(messages):
+    queue = MessageQueue()
+    for message in messages:
+        queue.add_message(message)
+    return queue
+
+
+def test_breaking_out_of_results_hands_back_unfinished_messages():
+    messages = [("key %d" % (i % 7), "message %d" % i) for i in range(2000)]
+    queue = fill(messages)
+    processor = PartitionedMessageProcessor(queue, handler=slow_upper, partitions=2, batch_size=50,
+                                            result_capacity=2, in_flight=2)
+    processor.start()
+    seen = []
+    for _, result in processor.results():
+        seen.append(result)
+        if len(seen) == 10:
+            break
+    processor.stop()
+    # Answered results wait for the next results(); everything else is back
+    # in the queue, still in queue order.
+    seen.extend(result for _, result in processor.ready)
+    requeued = list(queue.messages)
+    assert requeued == [message for message in messages if message in requeued]
+    assert sorted(seen + [payload.upper() for _, payload in requeued]) == sorted(
+        payload.upper() for _, payload in messages)
+
+
+def test_dead_worker_raises_instead_of_hanging():
+    messages = [("a", "crash")] + [("key %d" % i, "message %d" % i) for i in range(100)]
+    queue = fill(messages)
+    with PartitionedMessageProcessor(queue, handler=exit_on_crash, partitions=2, batch_size=20) as processor:
+        with pytest.raises(RuntimeError, match="exited with code 3"):
+            processor.process_all()
+    handled = {result.lower() for result in processor.processed_messages}
+    assert [message for message in messages if message[1] not in handled] == list(queue.messages)
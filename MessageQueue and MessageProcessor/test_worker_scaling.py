@@ -0,0 +1,31 @@
+import time
+
+from MessageProcessor import MessageProcessor
+from MessageQueue import MessageQueue
+
+
+def sleepy_upper(message):
+    # An I/O-bound handler: sleeping releases the GIL like a socket read.
+    time.sleep(0.005)
+    return message.upper()
+
+
+def drain(workers, size=200):
+    queue = MessageQueue()
+    for i in range(size):
+        queue.add_message("message %d" % i)
+    processor = MessageProcessor(queue, handler=sleepy_upper, workers=workers)
+    start = time.perf_counter()
+    processor.start()
+    processor.stop(drain=True)
+    elapsed = time.perf_counter() - start
+    assert sorted(processor.processed_messages) == sorted("MESSAGE %d" % i for i in range(size))
+    return elapsed
+
+
+def test_workers_overlap_io_bound_handlers():
+    single = drain(1)
+    several = drain(8)
+    # Eight workers would ideally be eight times faster; half of that leaves
+    # room for a loaded machine while still failing if workers serialise.
+    assert single / several > 4, "8 workers took %.3fs, 1 worker %.3fs" % (several, single)
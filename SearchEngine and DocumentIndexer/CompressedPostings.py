@@ -0,0 +1,79 @@
+from array import array
+from bisect import bisect_right
+
+BLOCK_SIZE = 128
+
+
+def encode_block(ordinals):
+    out = bytearray()
+    previous = ordinals[0]
+    for ordinal in ordinals[1:]:
+        delta = ordinal - previous
+        previous = ordinal
+        while delta >= 0x80:
+            out.append(delta & 0x7F | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def decode_block(first, data):
+    ordinals = [first]
+    value = first
+    delta = shift = 0
+    for byte in data:
+        delta |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            value += delta
+            ordinals.append(value)
+            delta = shift = 0
+    return ordinals
+
+
+class CompressedPostings:
+    # Sorted ordinals split into blocks; each block stores its first ordinal
+    # uncompressed (doubling as a skip pointer) and the rest as varint deltas.
+    def __init__(self, ordinals, doc_ids, ordinal_of):
+        self.doc_ids = doc_ids
+        self.ordinal_of = ordinal_of
+        self.count = len(ordinals)
+        self.firsts = array("I")
+        self.blocks = []
+        for start in range(0, len(ordinals), BLOCK_SIZE):
+            block = ordinals[start:start + BLOCK_SIZE]
+            self.firsts.append(block[0])
+            self.blocks.append(encode_block(block))
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __iter__(self):
+        doc_ids = self.doc_ids
+        for first, data in zip(self.firsts, self.blocks):
+            for ordinal in decode_block(first, data):
+                yield doc_ids[ordinal]
+
+    def __contains__(self, doc_id):
+        ordinal = self.ordinal_of.get(doc_id)
+        return ordinal is not None and self.contains_ordinal(ordinal)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def iter_ordinals(self):
+        for first, data in zip(self.firsts, self.blocks):
+            yield from decode_block(first, data)
+
+    def contains_ordinal(self, ordinal):
+        i = bisect_right(self.firsts, ordinal) - 1
+        if i < 0:
+            return False
+        return ordinal in decode_block(self.firsts[i], self.blocks[i])
+
+    def __repr__(self):
+        return "CompressedPostings(%r)" % list(self)
@@ -0,0 +1,139 @@
+import json
+import lzma
+import mmap
+import os
+import struct
+import zlib
+from collections.abc import MutableMapping
+
+CODECS = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+# content length (-1 marks a deletion), then the length of the JSON doc id.
+RECORD = struct.Struct("<iI")
+
+
+class NullStore(MutableMapping):
+    # Keeps nothing; for engines that only ever return document ids.
+    def __getitem__(self, doc_id):
+        raise KeyError(doc_id)
+
+    def __setitem__(self, doc_id, content):
+        pass
+
+    def __delitem__(self, doc_id):
+        raise KeyError(doc_id)
+
+    def __iter__(self):
+        return iter(())
+
+    def __len__(self):
+        return 0
+
+
+class CompressedStore(MutableMapping):
+    def __init__(self, codec="zlib"):
+        if codec not in CODECS:
+            raise ValueError("unknown codec %r; expected one of %s" % (codec, ", ".join(CODECS)))
+        self.compress, self.decompress = CODECS[codec]
+        self.blobs = {}
+
+    def __getitem__(self, doc_id):
+        return self.decompress(self.blobs[doc_id]).decode("utf-8")
+
+    def __setitem__(self, doc_id, content):
+        self.blobs[doc_id] = self.compress(content.encode("utf-8"))
+
+    def __delitem__(self, doc_id):
+        del self.blobs[doc_id]
+
+    def __iter__(self):
+        return iter(self.blobs)
+
+    def __len__(self):
+        return len(self.blobs)
+
+
+class FileStore(MutableMapping):
+    # Appends every document to one file and keeps only (offset, length) per
+    # document in memory. Reopening a file rescans its record headers through
+    # an mmap, so payloads are skipped over rather than read, and later
+    # records and deletions win. A record cut short by a crash is dropped.
+    def __init__(self, path):
+        self.path = path
+        self.offsets = {}
+        self.file = open(path, "a+b")
+        size = os.fstat(self.file.fileno()).st_size
+        if size:
+            with mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                end = self._scan(data, size)
+            if end < size:
+                # Later appends must not follow the torn record.
+                self.file.truncate(end)
+
+    def _scan(self, data, size):
+        # Returns where the last complete record ends.
+        position = 0
+        while position + RECORD.size <= size:
+            length, id_length = RECORD.unpack_from(data, position)
+            start = position + RECORD.size + id_length
+            if start + max(length, 0) > size:
+                break
+            doc_id = json.loads(data[position + RECORD.size:start])
+            if length < 0:
+                self.offsets.pop(doc_id, None)
+                position = start
+                continue
+            self.offsets[doc_id] = (start, length)
+            position = start + length
+        return position
+
+    def close(self):
+        self.file.close()
+
+    def _append(self, doc_id, payload, length):
+        key = json.dumps(doc_id).encode("utf-8")
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell() + RECORD.size + len(key)
+        self.file.write(RECORD.pack(length, len(key)) + key + payload)
+        self.file.flush()
+        return offset
+
+    def __getitem__(self, doc_id):
+        offset, length = self.offsets[doc_id]
+        if hasattr(os, "pread"):
+            data = os.pread(self.file.fileno(), length, offset)
+        else:
+            self.file.seek(offset)
+            data = self.file.read(length)
+        return data.decode("utf-8")
+
+    def __setitem__(self, doc_id, content):
+        payload = content.encode("utf-8")
+        self.offsets[doc_id] = (self._append(doc_id, payload, len(payload)), len(payload))
+
+    def __delitem__(self, doc_id):
+        del self.offsets[doc_id]
+        self._append(doc_id, b"", -1)
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+def make_store(mode="memory", path=None):
+    if mode == "memory":
+        return {}
+    if mode == "none":
+        return NullStore()
+    if mode in CODECS:
+        return CompressedStore(mode)
+    if mode == "file":
+        if path is None:
+            raise ValueError("the file content store needs a path")
+        return FileStore(path)
+    raise ValueError("unknown content store %r" % mode)
@@ -0,0 +1,211 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from Tokenizer import Tokenizer, describe, restore
+
+# magic, byte order, doc count, term count, total length, then the offsets of
+# the doc table, doc lengths, term table, term refs, posting blocks and the
+# JSON description of the tokenizer, which runs to the end of the file.
+HEADER = struct.Struct("<8s8sQQQQQQQQQ")
+MAGIC = b"DIDX0002"
+
+
+def _pad(out):
+    out.write(b"\0" * (-out.tell() % 8))
+
+
+def write_index(indexer, path):
+    # Ordinals are renumbered densely over the documents still present.
+    doc_ids = [doc_id for doc_id in indexer.doc_ids if doc_id in indexer.doc_lengths]
+    dense = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+    terms = sorted(word for word, postings in indexer.index.items() if postings)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(b"\0" * HEADER.size)
+
+        doc_blob = [json.dumps(doc_id).encode("utf-8") for doc_id in doc_ids]
+        doc_table = out.tell()
+        offsets = array("Q", [0])
+        for blob in doc_blob:
+            offsets.append(offsets[-1] + len(blob))
+        offsets.tofile(out)
+        out.write(b"".join(doc_blob))
+        _pad(out)
+
+        doc_lengths = out.tell()
+        array("I", [indexer.doc_lengths[doc_id] for doc_id in doc_ids]).tofile(out)
+        _pad(out)
+
+        term_blob = [term.encode("utf-8") for term in terms]
+        term_table = out.tell()
+        offsets = array("Q", [0])
+        for blob in term_blob:
+            offsets.append(offsets[-1] + len(blob))
+        offsets.tofile(out)
+        out.write(b"".join(term_blob))
+        _pad(out)
+
+        # Each term ref is (block offset, posting count); a block holds the
+        # dense ordinals followed by the matching term frequencies.
+        term_refs = out.tell()
+        out.write(b"\0" * (16 * len(terms)))
+        postings_start = out.tell()
+        refs = array("Q")
+        for term in terms:
+            postings = indexer.get_postings(term)
+            refs.append(out.tell())
+            refs.append(len(postings))
+            array("I", [dense[doc_id] for doc_id, _, _ in postings]).tofile(out)
+            array("I", [tf for _, tf, _ in postings]).tofile(out)
+        _pad(out)
+        out.seek(term_refs)
+        refs.tofile(out)
+
+        out.seek(0, os.SEEK_END)
+        tokenizer = out.tell()
+        out.write(json.dumps(describe(getattr(indexer, "tokenizer", None) or Tokenizer())).encode("utf-8"))
+
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, sys.byteorder.encode("ascii").ljust(8, b"\0"),
+                              len(doc_ids), len(terms), indexer.total_length,
+                              doc_table, doc_lengths, term_table, term_refs, postings_start, tokenizer))
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, path)
+    return True
+
+
+class DiskIndex:
+    generation = 0
+    # Token positions are not saved, so phrase queries are refused.
+    positions = None
+
+    # Queries must be tokenized as the documents were, so the tokenizer is
+    # rebuilt from the file. One that cannot be (a lambda, say) must be
+    # passed as tokenizer, which also overrides the saved one.
+    def __init__(self, path, tokenizer=None):
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, byteorder, self.doc_count, self.term_count, self.total_length, doc_table,
+         doc_lengths, term_table, term_refs, _, tokenizer_at) = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise ValueError("%s is not a saved index" % path)
+        if byteorder.rstrip(b"\0").decode("ascii") != sys.byteorder:
+            raise ValueError("%s was written with a different byte order" % path)
+        if tokenizer is None:
+            tokenizer = restore(json.loads(self.mm[tokenizer_at:]))
+            if tokenizer is None:
+                raise ValueError("%s was built with a tokenizer that cannot be restored; pass it as tokenizer"
+                                 % path)
+        self.tokenizer = tokenizer
+
+        # Every table is a zero-copy view, so only the pages a query touches
+        # are ever read from disk.
+        view = memoryview(self.mm)
+        self.view = view
+        self.doc_offsets = view[doc_table:doc_table + 8 * (self.doc_count + 1)].cast("Q")
+        self.doc_blob = doc_table + 8 * (self.doc_count + 1)
+        self.doc_lengths = view[doc_lengths:doc_lengths + 4 * self.doc_count].cast("I")
+        self.term_offsets = view[term_table:term_table + 8 * (self.term_count + 1)].cast("Q")
+        self.term_blob = term_table + 8 * (self.term_count + 1)
+        self.term_refs = view[term_refs:term_refs + 16 * self.term_count].cast("Q")
+        self._ordinals = None
+
+    def close(self):
+        for name in ("doc_offsets", "doc_lengths", "term_offsets", "term_refs", "view"):
+            getattr(self, name).release()
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_document(self, doc_id, content):
+        raise TypeError("DiskIndex is read-only; add documents to a DocumentIndexer and save it")
+
+    def _term(self, i):
+        start = self.term_blob + self.term_offsets[i]
+        return self.mm[start:self.term_blob + self.term_offsets[i + 1]]
+
+    def _doc_id(self, ordinal):
+        start = self.doc_blob + self.doc_offsets[ordinal]
+        return json.loads(self.mm[start:self.doc_blob + self.doc_offsets[ordinal + 1]])
+
+    def _lower_bound(self, key):
+        lo, hi = 0, self.term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, word):
+        key = word.encode("utf-8")
+        i = self._lower_bound(key)
+        if i < self.term_count and self._term(i) == key:
+            return i
+        return -1
+
+    def prefix_terms(self, prefix, limit=None):
+        # UTF-8 bytes sort like the strings they encode, so the terms with a
+        # prefix are one run of the term table.
+        key = prefix.encode("utf-8")
+        found = []
+        i = self._lower_bound(key)
+        while i < self.term_count and len(found) != limit:
+            term = self._term(i)
+            if not term.startswith(key):
+                break
+            found.append(term.decode("utf-8"))
+            i += 1
+        return found
+
+    @property
+    def ordinals(self):
+        # doc_id -> ordinal, for merging posting lists; decoding the whole
+        # doc table is left until a query first needs it.
+        if self._ordinals is None:
+            self._ordinals = {self._doc_id(ordinal): ordinal for ordinal in range(self.doc_count)}
+        return self._ordinals
+
+    def _block(self, word):
+        i = self._find(word)
+        if i < 0:
+            return None, None
+        start, count = self.term_refs[2 * i], self.term_refs[2 * i + 1]
+        ordinals = self.view[start:start + 4 * count].cast("I")
+        freqs = self.view[start + 4 * count:start + 8 * count].cast("I")
+        return ordinals, freqs
+
+    def get_documents_with_word(self, word):
+        ordinals, _ = self._block(word)
+        if ordinals is None:
+            return []
+        return [self._doc_id(ordinal) for ordinal in ordinals]
+
+    def get_postings(self, word):
+        ordinals, freqs = self._block(word)
+        if ordinals is None:
+            return []
+        lengths = self.doc_lengths
+        return [(self._doc_id(ordinal), tf, lengths[ordinal]) for ordinal, tf in zip(ordinals, freqs)]
+
+    def all_documents(self):
+        return [self._doc_id(ordinal) for ordinal in range(self.doc_count)]
+
+    def document_count(self):
+        return self.doc_count
+
+    def average_document_length(self):
+        if not self.doc_count:
+            return 0.0
+        return self.total_length / self.doc_count
@@ -1,15 +1,510 @@
+import heapq
+import sys
+from bisect import bisect_left, insort
+from collections import Counter
+
+from CompressedPostings import CompressedPostings
+from DiskIndex import write_index
+from FuzzyIndex import FuzzyIndex
+from LayeredMap import DELETED, LayeredMap, PostingsView, TrackedDict
+from Tokenizer import Tokenizer
+
+# Per-term and per-document maps a snapshot publishes as LayeredMaps.
+PUBLISHED_MAPS = ("index", "term_freqs", "doc_lengths", "stale", "positions")
+# New words a sorted term list can take before it is merged, on top of 1/32
+# of the merged run.
+RECENT_TERMS = 1024
+
+
 class DocumentIndexer:
-    def __init__(self):
+    def __init__(self, positions=False, tokenizer=None):
+        # Turns text into terms for documents and, through SearchEngine,
+        # for queries too; the default matches lower().split().
+        self.tokenizer = Tokenizer() if tokenizer is None else tokenizer
         self.index = {}
-        
+        self.ordinals = {}
+        self.doc_ids = []
+        self.term_freqs = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+        # Bumped on every change that can alter search results.
+        self.generation = 0
+        # doc_id -> words whose postings still hold the doc although it no
+        # longer contains them, and word -> number of such stale entries.
+        self.tombstones = {}
+        self.stale = {}
+        # doc_id -> {word: [token positions]} when positions are recorded.
+        self.positions = {} if positions else None
+        # Sorted term dictionary, kept as a large run and a small recent one
+        # (see term_runs); words indexed since they were last sorted wait in
+        # new_terms.
+        self.terms = []
+        self.recent = []
+        self.new_terms = []
+        self.length_buckets = None
+        # Every term in the order first indexed, appended to and never
+        # changed, so the FuzzyIndex shared with snapshots can catch up.
+        self.term_history = []
+        self.fuzzy = FuzzyIndex()
+        # The last published snapshot, and words whose current posting list
+        # a snapshot shares: those lists may only be appended to, so any
+        # other change copies the list first.
+        self.last_snapshot = None
+        self.shared = set()
+
     def add_document(self, doc_id, content):
-        words = content.lower().split()
+        self.generation += 1
+        tokens = self.tokenizer(content)
+        words = Counter(tokens)
+        offset = self.doc_lengths.get(doc_id, 0)
+        self.doc_lengths[doc_id] = offset + len(tokens)
+        self.total_length += len(tokens)
+        if self.positions is not None:
+            self._add_positions(doc_id, tokens, offset)
+        if doc_id not in self.ordinals:
+            self.ordinals[doc_id] = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+            self.term_freqs[doc_id] = words
+            for word in words:
+                postings = self.index.get(word)
+                if postings is None:
+                    self.index[word] = [doc_id]
+                    self.new_terms.append(word)
+                    self.term_history.append(word)
+                else:
+                    if type(postings) is not list:
+                        postings = self.index[word] = list(postings)
+                    postings.append(doc_id)
+            return True
+
+        self._extend_document(doc_id, words)
+        return True
+
+    def _extend_document(self, doc_id, words):
+        # Per-document structures are replaced rather than changed in place,
+        # so snapshots that share them never see a half-applied change.
+        freqs = self.term_freqs[doc_id] = Counter(self.term_freqs.get(doc_id, ()))
+        for word, count in words.items():
+            if word in freqs:
+                freqs[word] += count
+                continue
+            freqs[word] = count
+            self._insert_posting(doc_id, word)
+
+    def _insert_posting(self, doc_id, word):
+        # A stale entry for the word is simply revived.
+        tombstone = self.tombstones.get(doc_id)
+        if tombstone and word in tombstone:
+            tombstone.discard(word)
+            self._unmark_stale(word)
+            return
+        # A known document keeps its ordinal, so new postings are inserted
+        # in place to keep every posting list sorted by ordinal.
+        postings = self.index.get(word)
+        if postings is None:
+            self.index[word] = [doc_id]
+            self.new_terms.append(word)
+            self.term_history.append(word)
+        else:
+            if type(postings) is not list or word in self.shared:
+                postings = self.index[word] = list(postings)
+                self.shared.discard(word)
+            insort(postings, doc_id, key=self.ordinals.__getitem__)
+
+    def _add_positions(self, doc_id, tokens, offset=0):
+        # Appending to a document continues its positions after the old end.
+        positions = self.positions.get(doc_id) if offset else None
+        if positions is None:
+            positions = {}
+        else:
+            positions = {word: list(found) for word, found in positions.items()}
+        self.positions[doc_id] = positions
+        for position, word in enumerate(tokens, offset):
+            if word in positions:
+                positions[word].append(position)
+            else:
+                positions[word] = [position]
+
+    def _mark_stale(self, doc_id, words):
+        tombstone = self.tombstones.setdefault(doc_id, set())
+        for word in words:
+            tombstone.add(word)
+            self.stale[word] = self.stale.get(word, 0) + 1
+
+    def _unmark_stale(self, word):
+        if self.stale[word] == 1:
+            del self.stale[word]
+        else:
+            self.stale[word] -= 1
+
+    def update_document(self, doc_id, content):
+        self.generation += 1
+        if doc_id not in self.ordinals:
+            return self.add_document(doc_id, content)
+        tokens = self.tokenizer(content)
+        words = Counter(tokens)
+        old = self.term_freqs.get(doc_id, {})
+        self._mark_stale(doc_id, [word for word in old if word not in words])
+        for word in words:
+            if word not in old:
+                self._insert_posting(doc_id, word)
+        self.term_freqs[doc_id] = words
+        self.total_length += len(tokens) - self.doc_lengths.get(doc_id, 0)
+        self.doc_lengths[doc_id] = len(tokens)
+        if self.positions is not None:
+            self._add_positions(doc_id, tokens)
+        return True
+
+    def delete_document(self, doc_id):
+        words = self.term_freqs.pop(doc_id, None)
+        if words is None:
+            return False
+        self.generation += 1
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        if self.positions is not None:
+            del self.positions[doc_id]
+        self._mark_stale(doc_id, words)
+        return True
+
+    def compact(self, max_docs=None):
+        # Removes stale entries for up to max_docs tombstoned documents, so
+        # space can be reclaimed a little at a time between queries. Ordinals
+        # are never reused, which lets snapshots share ordinals and doc_ids.
+        compacted = 0
+        key = self.ordinals.__getitem__
+        while self.tombstones and (max_docs is None or compacted < max_docs):
+            doc_id, words = self.tombstones.popitem()
+            for word in words:
+                postings = self.index[word]
+                if type(postings) is not list or word in self.shared:
+                    postings = self.index[word] = list(postings)
+                    self.shared.discard(word)
+                del postings[bisect_left(postings, key(doc_id), key=key)]
+                if not postings:
+                    # The word stays in the sorted runs, where readers skip
+                    # it, until they are next merged.
+                    del self.index[word]
+                self._unmark_stale(word)
+            compacted += 1
+        return compacted
+
+    def merge(self, segment):
+        self.generation += 1
+        # Documents new to this index get ordinals after every existing one,
+        # so their postings can be appended segment by segment.
+        known = set()
+        for doc_id, words in segment.term_freqs.items():
+            length = segment.doc_lengths[doc_id]
+            offset = self.doc_lengths.get(doc_id, 0)
+            self.doc_lengths[doc_id] = offset + length
+            self.total_length += length
+            if self.positions is not None:
+                self._merge_positions(doc_id, segment.positions[doc_id], offset)
+            if doc_id in self.ordinals:
+                known.add(doc_id)
+                self._extend_document(doc_id, words)
+            else:
+                self.ordinals[doc_id] = len(self.doc_ids)
+                self.doc_ids.append(doc_id)
+                self.term_freqs[doc_id] = words
+        # Terms from a worker process arrive as fresh copies of the strings.
+        for word, doc_ids in segment.index.items():
+            word = sys.intern(word)
+            if known:
+                doc_ids = [doc_id for doc_id in doc_ids if doc_id not in known]
+                if not doc_ids:
+                    continue
+            postings = self.index.get(word)
+            if postings is None:
+                self.index[word] = list(doc_ids)
+                self.new_terms.append(word)
+                self.term_history.append(word)
+            else:
+                if type(postings) is not list:
+                    postings = self.index[word] = list(postings)
+                postings.extend(doc_ids)
+        return True
+
+    def _merge_positions(self, doc_id, positions, offset):
+        if not offset:
+            self.positions[doc_id] = positions
+            return
+        current = {word: list(found) for word, found in self.positions.get(doc_id, {}).items()}
+        self.positions[doc_id] = current
+        for word, found in positions.items():
+            current.setdefault(word, []).extend(position + offset for position in found)
+
+    def save(self, path):
+        return write_index(self, path)
+
+    def freeze(self):
+        for word, postings in self.index.items():
+            if type(postings) is list:
+                self.index[word] = tuple(postings)
+        return True
+
+    def snapshot(self):
+        # Publishes a read-only IndexSnapshot in time proportional to what
+        # changed since the previous one. The first call switches the maps
+        # to TrackedDicts, which record the keys written since; each publish
+        # stacks just those entries on the previous snapshot's LayeredMaps.
+        previous = self.last_snapshot
+        if previous is None:
+            for name in PUBLISHED_MAPS:
+                current = getattr(self, name)
+                if current is not None:
+                    setattr(self, name, TrackedDict(current))
+        snapshot = IndexSnapshot.__new__(IndexSnapshot)
+        snapshot.tokenizer = self.tokenizer
+        snapshot.ordinals = self.ordinals
+        snapshot.doc_ids = self.doc_ids
+        snapshot.total_length = self.total_length
+        snapshot.generation = self.generation
+        snapshot.tombstones = {}
+        # The runs are replaced rather than changed, so they can be shared.
+        snapshot.terms, snapshot.recent = self.term_runs()
+        snapshot.new_terms = []
+        snapshot.length_buckets = None
+        snapshot.last_snapshot = None
+        snapshot.shared = set()
+        snapshot.term_history = self.term_history
+        snapshot.fuzzy = self.fuzzy
+        for name in ("term_freqs", "doc_lengths", "stale", "positions"):
+            current = getattr(self, name)
+            if current is None:
+                setattr(snapshot, name, None)
+                continue
+            published = LayeredMap() if previous is None else getattr(previous, name)
+            dirty = current if previous is None else current.dirty
+            get = current.get
+            setattr(snapshot, name, published.push({key: get(key, DELETED) for key in dirty}, len(current)))
+        self._publish_postings(previous, snapshot)
+        for name in PUBLISHED_MAPS:
+            current = getattr(self, name)
+            if current is not None:
+                current.dirty.clear()
+        self.last_snapshot = snapshot
+        return snapshot
+
+    def _publish_postings(self, previous, snapshot):
+        # Appends to a posting list do not go through the index, so the
+        # words of every document added or changed count as written too; a
+        # document deleted since has lost its term_freqs, but every one of
+        # its words went through stale.
+        index = self.index
+        if previous is None:
+            published = LayeredMap()
+            words = index.keys()
+        else:
+            published = previous.index
+            term_freqs = self.term_freqs
+            words = set(index.dirty)
+            words.update(self.stale.dirty)
+            for doc_id in term_freqs.dirty:
+                words.update(term_freqs.get(doc_id, ()))
+        delta = {}
         for word in words:
-            if word not in self.index:
-                self.index[word] = []
-            if doc_id not in self.index[word]:
-                self.index[word].append(doc_id)
+            postings = index.get(word, DELETED)
+            if type(postings) is list:
+                self.shared.add(word)
+                postings = PostingsView(postings, len(postings))
+            delta[word] = postings
+        snapshot.index = published.push(delta, len(index))
+
+    def compress(self):
+        ordinals = self.ordinals
+        for word, postings in self.index.items():
+            if type(postings) is not CompressedPostings and postings:
+                self.index[word] = CompressedPostings([ordinals[doc_id] for doc_id in postings],
+                                                      self.doc_ids, ordinals)
         return True
-        
+
     def get_documents_with_word(self, word):
-        return self.index.get(word.lower(), [])
+        postings = self.index.get(word, [])
+        if word in self.stale:
+            term_freqs = self.term_freqs
+            return [doc_id for doc_id in postings if word in term_freqs.get(doc_id, ())]
+        return postings
+
+    def get_postings(self, word):
+        term_freqs = self.term_freqs
+        doc_lengths = self.doc_lengths
+        return [(doc_id, term_freqs[doc_id][word], doc_lengths[doc_id])
+                for doc_id in self.get_documents_with_word(word)]
+
+    def term_runs(self):
+        # The sorted terms as two runs: the bulk of them, and the words added
+        # since the two were last merged. A new word only re-sorts the small
+        # run, which is merged into the large one once it outgrows a fraction
+        # of it, so lookups stay logarithmic while writes and queries
+        # interleave. Words dropped by compact stay in the runs, where
+        # readers skip them, until that merge. Runs are replaced, never
+        # changed in place, so a snapshot can keep sharing the ones it got.
+        if self.new_terms:
+            terms = self.terms
+            recent = self.recent
+            fresh = [word for word in set(self.new_terms)
+                     if not _contains(terms, word) and not _contains(recent, word)]
+            fresh.sort()
+            recent = recent + fresh
+            # Two sorted runs, which sort() merges in linear time.
+            recent.sort()
+            if len(recent) > RECENT_TERMS + len(terms) // 32:
+                index = self.index
+                terms = terms + recent
+                terms.sort()
+                self.terms = [word for word in terms if word in index]
+                recent = []
+            self.recent = recent
+            self.new_terms = []
+        return self.terms, self.recent
+
+    def prefix_terms(self, prefix, limit=None):
+        end_key = prefix + "\U0010ffff"
+        matching = []
+        for terms in self.term_runs():
+            start = bisect_left(terms, prefix)
+            matching.append(map(terms.__getitem__, range(start, bisect_left(terms, end_key, start))))
+        found = []
+        for term in heapq.merge(*matching):
+            if self._has_live_postings(term):
+                found.append(term)
+                if len(found) == limit:
+                    break
+        return found
+
+    def terms_by_length(self):
+        # Each sorted run bucketed by length, rebuilt whenever that run has
+        # been replaced.
+        cached = self.length_buckets or ()
+        runs = []
+        for i, terms in enumerate(self.term_runs()):
+            if i < len(cached) and cached[i][0] is terms:
+                runs.append(cached[i])
+                continue
+            buckets = {}
+            for term in terms:
+                bucket = buckets.get(len(term))
+                if bucket is None:
+                    buckets[len(term)] = [term]
+                else:
+                    bucket.append(term)
+            runs.append((terms, buckets))
+        self.length_buckets = runs
+        return [buckets for _, buckets in runs]
+
+    def build_fuzzy(self, max_distance=2, background=False):
+        # Brings the FuzzyIndex shared with every snapshot up to date and,
+        # for distance 2, builds its deletion map. Until that is ready,
+        # distance 2 queries walk the sorted terms like wider ones.
+        self.fuzzy.catch_up(self.term_history)
+        if max_distance >= 2:
+            self.fuzzy.build_deletions(background)
+        return True
+
+    def fuzzy_terms(self, word, max_distance=1):
+        fuzzy = self.fuzzy
+        if max_distance <= 1 or (max_distance == 2 and fuzzy.deletions is not None):
+            fuzzy.catch_up(self.term_history)
+            return [(distance, term) for distance, term in fuzzy.search(word, max_distance)
+                    if self._has_live_postings(term)]
+        # Wider searches walk the sorted terms instead, as their edit
+        # neighbourhoods grow too quickly to enumerate.
+        found = []
+        for buckets in self.terms_by_length():
+            for size in range(max(1, len(word) - max_distance), len(word) + max_distance + 1):
+                if size in buckets:
+                    self._fuzzy_walk(buckets[size], size, word, max_distance, found)
+        found.sort()
+        return found
+
+    def _fuzzy_walk(self, terms, size, word, max_distance, found):
+        # Walks terms of one length as an implicit trie: terms sharing a
+        # prefix reuse its Levenshtein rows, and a prefix whose rows can no
+        # longer reach the final cell within max_distance (given how many
+        # characters both strings still have) is skipped by bisect.
+        length = len(word)
+        cap = max_distance + 1
+        band_filler = [cap] * length
+        rows = [[min(j, cap) for j in range(length + 1)]]
+        current = ""
+        i = 0
+        while i < len(terms):
+            term = terms[i]
+            shared = 0
+            while shared < len(current) and current[shared] == term[shared]:
+                shared += 1
+            del rows[shared + 1:]
+            skipped = False
+            for depth in range(shared, size):
+                # Only cells within max_distance of the diagonal can stay
+                # under the limit; everything else is pinned at cap.
+                previous = rows[-1]
+                char = term[depth]
+                consumed = depth + 1
+                row = [min(consumed, cap)] + band_filler
+                remaining = size - consumed - length
+                bound = row[0] + abs(remaining)
+                for j in range(max(1, consumed - max_distance), min(length, consumed + max_distance) + 1):
+                    cost = previous[j - 1] + (char != word[j - 1])
+                    if previous[j] < cost:
+                        cost = previous[j] + 1
+                    if row[j - 1] < cost:
+                        cost = row[j - 1] + 1
+                    if cost > cap:
+                        cost = cap
+                    row[j] = cost
+                    estimate = cost + abs(remaining + j)
+                    if estimate < bound:
+                        bound = estimate
+                rows.append(row)
+                if bound > max_distance:
+                    current = term[:consumed]
+                    i = bisect_left(terms, current + "\U0010ffff", i + 1)
+                    skipped = True
+                    break
+            if skipped:
+                continue
+            current = term
+            distance = rows[-1][-1]
+            if distance <= max_distance and self._has_live_postings(term):
+                found.append((distance, term))
+            i += 1
+
+    def _has_live_postings(self, word):
+        postings = self.index.get(word)
+        return bool(postings) and self.stale.get(word, 0) < len(postings)
+
+    def get_positions(self, doc_id, word):
+        return self.positions[doc_id].get(word, [])
+
+    def all_documents(self):
+        term_freqs = self.term_freqs
+        return [doc_id for doc_id in self.doc_ids if doc_id in term_freqs]
+
+    def document_count(self):
+        return len(self.doc_lengths)
+
+    def average_document_length(self):
+        if not self.doc_lengths:
+            return 0.0
+        return self.total_length / len(self.doc_lengths)
+
+
+class IndexSnapshot(DocumentIndexer):
+    # A read-only DocumentIndexer made by DocumentIndexer.snapshot. Its maps
+    # are LayeredMaps shared with neighbouring snapshots, and its sorted term
+    # runs are the writer's at the time it was published.
+    pass
+
+
+def _contains(terms, word):
+    i = bisect_left(terms, word)
+    return i < len(terms) and terms[i] == word
+
+
+def build_segment(documents, positions=False, tokenizer=None):
+    segment = DocumentIndexer(positions, tokenizer)
+    for doc_id, content in documents:
+        segment.add_document(doc_id, content)
+    return segment
@@ -0,0 +1,152 @@
+import threading
+
+
+def bounded_distance(a, b, limit):
+    # Levenshtein distance, or limit + 1 as soon as it must exceed limit.
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        row = [i]
+        for j, other in enumerate(b, 1):
+            cost = previous[j - 1] + (char != other)
+            if previous[j] < cost:
+                cost = previous[j] + 1
+            if row[j - 1] < cost:
+                cost = row[j - 1] + 1
+            row.append(cost)
+        if min(row) > limit:
+            return limit + 1
+        previous = row
+    return previous[-1]
+
+
+class FuzzyIndex:
+    # Finds the terms within one or two edits of a word without scanning the
+    # vocabulary. Terms are only ever added, so one index can serve a writer
+    # and all of its snapshots; callers drop terms they no longer hold.
+    #
+    # Distance 1 generates every string one edit from the word over the
+    # alphabet of the vocabulary and looks them up. Distance 2 meets in the
+    # middle: a term two edits away is one edit from some string one edit
+    # away, and two strings one edit apart share a single deletion, so the
+    # deletions of those strings are looked up in a map from every one-
+    # character deletion of every term to the terms. The map costs about
+    # seven entries per term (seconds and hundreds of MB at a million
+    # terms), so it is only built when build_deletions is called; until it
+    # is ready, distance 2 is left to the caller.
+    def __init__(self):
+        self.terms = set()
+        self.alphabet = ""
+        self.deletions = None
+        # Terms added while build_deletions runs, or None when it is not.
+        self.pending = None
+        # How much of the owner's append-only term history has been added.
+        self.seen = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def catch_up(self, history):
+        # Only a reader that finds the index behind takes the lock.
+        if self.seen == len(history):
+            return
+        with self.lock:
+            end = len(history)
+            if self.seen < end:
+                self._add(history[self.seen:end])
+                self.seen = end
+
+    def _add(self, terms):
+        terms = [term for term in dict.fromkeys(terms) if term not in self.terms]
+        if not terms:
+            return
+        self.terms.update(terms)
+        alphabet = set(self.alphabet)
+        for term in terms:
+            alphabet.update(term)
+        if len(alphabet) != len(self.alphabet):
+            self.alphabet = "".join(sorted(alphabet))
+        if self.deletions is not None:
+            self._add_deletions(self.deletions, terms)
+        elif self.pending is not None:
+            self.pending.extend(terms)
+
+    @staticmethod
+    def _add_deletions(deletions, terms):
+        setdefault = deletions.setdefault
+        for term in terms:
+            for deleted in [term[:i] + term[i + 1:] for i in range(len(term))]:
+                # A deletion shared by several terms maps to a tuple of them.
+                if setdefault(deleted, term) is not term:
+                    found = deletions[deleted]
+                    deletions[deleted] = found + (term,) if type(found) is tuple else (found, term)
+
+    def build_deletions(self, background=False):
+        # Builds the distance 2 map without holding the lock, so lookups and
+        # catch_up carry on meanwhile; with background it runs in a daemon
+        # thread and this returns at once.
+        with self.lock:
+            if self.deletions is not None or self.pending is not None:
+                return True
+            self.pending = []
+            terms = list(self.terms)
+        if background:
+            threading.Thread(target=self._build_deletions, args=(terms,), daemon=True).start()
+        else:
+            self._build_deletions(terms)
+        return True
+
+    def _build_deletions(self, terms):
+        deletions = {}
+        self._add_deletions(deletions, terms)
+        with self.lock:
+            self._add_deletions(deletions, self.pending)
+            # Filled before it is published, so no reader sees it half built.
+            self.deletions = deletions
+            self.pending = None
+
+    def _edits(self, word):
+        splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+        alphabet = self.alphabet
+        edits = {head + tail[1:] for head, tail in splits if tail}
+        edits.update(head + char + tail[1:] for head, tail in splits if tail for char in alphabet)
+        edits.update(head + char + tail for head, tail in splits for char in alphabet)
+        edits.add(word)
+        return edits
+
+    def search(self, word, max_distance):
+        # (distance, term) pairs for every term within max_distance <= 2;
+        # distance 2 needs build_deletions to have finished.
+        if max_distance <= 0:
+            return [(0, word)] if word in self.terms else []
+        nearby = self._edits(word)
+        if max_distance == 1:
+            return sorted((0 if term == word else 1, term) for term in nearby.intersection(self.terms))
+        deletions = self.deletions
+        if deletions is None:
+            raise ValueError("distance 2 needs build_deletions() to have finished")
+        probes = set(nearby)
+        for edit in nearby:
+            probes.update([edit[:i] + edit[i + 1:] for i in range(len(edit))])
+        candidates = probes.intersection(self.terms)
+        for found in map(deletions.get, probes):
+            if found is not None:
+                if type(found) is tuple:
+                    candidates.update(found)
+                else:
+                    candidates.add(found)
+        matches = []
+        for term in candidates:
+            distance = bounded_distance(word, term, max_distance)
+            if distance <= max_distance:
+                matches.append((distance, term))
+        matches.sort()
+        return matches
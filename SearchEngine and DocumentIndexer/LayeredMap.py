@@ -0,0 +1,117 @@
+from collections.abc import Mapping
+
+# Marks a key removed in a newer layer than the one still holding it.
+DELETED = object()
+_ABSENT = object()
+
+
+class TrackedDict(dict):
+    # A dict that remembers every key written or removed since dirty was
+    # last cleared, so a snapshot only has to look at what changed.
+    __slots__ = ("dirty",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dirty = set()
+
+    def __setitem__(self, key, value):
+        self.dirty.add(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.dirty.add(key)
+
+    def pop(self, key, *default):
+        self.dirty.add(key)
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self.dirty.add(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.dirty.add(key)
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        self.dirty.update(self)
+        dict.clear(self)
+
+
+class PostingsView:
+    # The first length items of a posting list the writer only appends to,
+    # so a snapshot can share the list instead of copying it.
+    __slots__ = ("items", "length")
+
+    def __init__(self, items, length):
+        self.items = items
+        self.length = length
+
+
+class LayeredMap(Mapping):
+    # An immutable mapping made of dict layers, newest first. A new version
+    # is the previous one with a delta layer on top; a layer is folded into
+    # the one below whenever it is at least half that size, so there are
+    # O(log n) layers and each key is copied O(log n) times overall.
+    __slots__ = ("layers", "size")
+
+    def __init__(self, layers=(), size=0):
+        self.layers = layers
+        self.size = size
+
+    def push(self, delta, size):
+        if not delta:
+            return LayeredMap(self.layers, size)
+        layers = [delta]
+        layers.extend(self.layers)
+        while len(layers) > 1 and 2 * len(layers[0]) >= len(layers[1]):
+            newer = layers.pop(0)
+            merged = dict(layers[0])
+            merged.update(newer)
+            if len(layers) == 1:
+                merged = {key: value for key, value in merged.items() if value is not DELETED}
+            layers[0] = merged
+        return LayeredMap(tuple(layers), size)
+
+    def get(self, key, default=None):
+        for layer in self.layers:
+            value = layer.get(key, _ABSENT)
+            if value is not _ABSENT:
+                if value is DELETED:
+                    return default
+                if type(value) is PostingsView:
+                    return value.items[:value.length]
+                return value
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, _ABSENT)
+        if value is _ABSENT:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        for layer in self.layers:
+            value = layer.get(key, _ABSENT)
+            if value is not _ABSENT:
+                return value is not DELETED
+        return False
+
+    def __iter__(self):
+        seen = set()
+        for layer in self.layers:
+            for key, value in layer.items():
+                if key not in seen:
+                    seen.add(key)
+                    if value is not DELETED:
+                        yield key
+
+    def __len__(self):
+        return self.size
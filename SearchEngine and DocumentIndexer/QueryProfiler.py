@@ -0,0 +1,101 @@
+import threading
+import time
+
+STAGES = ("tokenize", "fetch", "score", "sort", "total")
+
+
+class Histogram:
+    # Power-of-two buckets over microseconds: bucket i holds durations
+    # below 2**i us, which is plenty to tell a p50 from a p99 spike.
+    def __init__(self):
+        self.buckets = [0] * 40
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.buckets[min(int(seconds * 1e6).bit_length(), 39)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        # Upper bound of the bucket holding the p-th percentile, in seconds.
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(2 ** i / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class QueryProfile:
+    # Timings of one query. Stage times accumulate, since fetching and
+    # scoring interleave term by term.
+    def __init__(self, query):
+        self.query = query
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        # (term, posting count, fetch seconds) in query order.
+        self.terms = []
+        self.start = self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] += now - self.last
+        self.last = now
+
+    def fetched(self, term, size):
+        now = time.perf_counter()
+        self.stages["fetch"] += now - self.last
+        self.terms.append((term, size, now - self.last))
+        self.last = now
+
+    def __repr__(self):
+        stages = " ".join("%s=%.3fms" % (stage, seconds * 1000) for stage, seconds in self.stages.items())
+        return "QueryProfile(%r, %s)" % (self.query, stages)
+
+
+class QueryProfiler:
+    # Attach to SearchEngine.profiler to time every search. The callback,
+    # if any, gets each finished QueryProfile, e.g. to log slow queries.
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self.queries = 0
+        self.lock = threading.Lock()
+
+    def begin(self, query):
+        return QueryProfile(query)
+
+    def finish(self, profile):
+        profile.stages["total"] = time.perf_counter() - profile.start
+        with self.lock:
+            self.queries += 1
+            for stage, seconds in profile.stages.items():
+                self.histograms[stage].record(seconds)
+        if self.callback is not None:
+            self.callback(profile)
+        return profile
+
+    def summary(self):
+        with self.lock:
+            return {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {stage: Histogram() for stage in STAGES}
+            self.queries = 0
@@ -1,20 +1,453 @@
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+from ContentStore import make_store
+from DocumentIndexer import build_segment
+from Tokenizer import Tokenizer
+
+QUERY_TOKEN = re.compile(r'"[^"]*"|[()]|[^\s()"]+')
+
+
+def intersect(smaller, larger, key):
+    # Gallops through the larger list, so the cost grows with the size of the
+    # smaller list and only logarithmically with the larger one.
+    result = []
+    lo, size = 0, len(larger)
+    for doc_id in smaller:
+        target = key(doc_id)
+        step = 1
+        hi = lo
+        while hi < size and key(larger[hi]) < target:
+            lo = hi + 1
+            hi += step
+            step *= 2
+        lo = bisect_left(larger, target, lo, min(hi + 1, size), key=key)
+        if lo == size:
+            break
+        if larger[lo] == doc_id:
+            result.append(doc_id)
+            lo += 1
+    return result
+
+
+def union(postings, key):
+    result = []
+    for doc_id in heapq.merge(*postings, key=key):
+        if not result or result[-1] != doc_id:
+            result.append(doc_id)
+    return result
+
+
+def read_documents(lines, format="lines", id_field="id", text_field="content", name=None):
+    # "lines" makes every non-blank line a document identified by its line
+    # number, or by "name:number" when the lines are named, so that lines of
+    # different files never share an id; "jsonl" reads one JSON object per
+    # line.
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        if format == "lines":
+            yield number if name is None else "%s:%d" % (name, number), line.rstrip("\r\n")
+        elif format == "jsonl":
+            record = json.loads(line)
+            yield record[id_field], record[text_field]
+        else:
+            raise ValueError("unknown document format %r" % format)
+
+
 class SearchEngine:
-    def __init__(self, indexer):
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, indexer, cache_size=0, concurrent=False, store="memory", store_path=None,
+                 profiler=None):
         self.indexer = indexer
-        self.documents = {}
-        
+        # A QueryProfiler times every search while attached; None costs a
+        # few attribute checks per query.
+        self.profiler = profiler
+        # Queries are tokenized exactly as the indexer tokenizes documents,
+        # with whatever callable it was built with (a DiskIndex restores it
+        # from the file); indexers without one get the default. The instance
+        # dict is read rather than getattr, so attributes a stand-in makes up
+        # on access (as mocks do) are not mistaken for a tokenizer.
+        tokenizer = getattr(indexer, "__dict__", {}).get("tokenizer")
+        self.tokenizer = Tokenizer() if tokenizer is None else tokenizer
+        # Full text is kept as given ("memory"), not at all ("none"),
+        # compressed per document ("zlib", "lzma") or in an append-only
+        # file addressed by offset ("file").
+        self.documents = make_store(store, store_path)
+        # One LRU shared by every thread. The lock is only held to look an
+        # entry up or store it, never while a query runs.
+        self.cache_size = cache_size
+        self.cache = OrderedDict() if cache_size else None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        self.cache_lock = threading.Lock()
+        # In concurrent mode writers are serialised and publish an immutable
+        # snapshot of the index when done; readers only ever use the latest
+        # published snapshot and never wait for a writer.
+        self.write_lock = threading.Lock() if concurrent else None
+        self.published = indexer.snapshot() if concurrent else None
+
+    @contextmanager
+    def writing(self):
+        if self.write_lock is None:
+            yield
+            return
+        with self.write_lock:
+            yield
+            self.published = self.indexer.snapshot()
+
+    def _reader(self):
+        published = self.published
+        return self.indexer if published is None else published
+
     def add_document(self, doc_id, content):
-        self.documents[doc_id] = content
-        self.indexer.add_document(doc_id, content)
+        with self.writing():
+            self.documents[doc_id] = content
+            self.indexer.add_document(doc_id, content)
         return True
-        
-    def search(self, query):
+
+    def update_document(self, doc_id, content):
+        with self.writing():
+            self.documents[doc_id] = content
+            self.indexer.update_document(doc_id, content)
+        return True
+
+    def delete_document(self, doc_id):
+        with self.writing():
+            if doc_id in self.documents:
+                del self.documents[doc_id]
+            return self.indexer.delete_document(doc_id)
+
+    def compact(self, max_docs=None):
+        with self.writing():
+            return self.indexer.compact(max_docs)
+
+    def get_document(self, doc_id):
+        return self.documents.get(doc_id)
+
+    def add_documents(self, documents, workers=None, batch_size=1000):
+        # Each merged batch is published on its own, so readers see whole
+        # batches appear one at a time.
+        documents = iter(documents)
+        batches = iter(lambda: list(islice(documents, batch_size)), [])
+        positions = self.indexer.positions is not None
+        count = 0
+        if not workers or workers <= 1:
+            for batch in batches:
+                count += self._merge_batch(batch, build_segment(batch, positions, self.tokenizer))
+            return count
+
+        # Only a couple of batches per worker are in flight at once, so the
+        # input iterable is never materialised as a whole.
+        pending = deque()
+        with ProcessPoolExecutor(workers) as executor:
+            for batch in batches:
+                pending.append((batch, executor.submit(build_segment, batch, positions, self.tokenizer)))
+                if len(pending) >= 2 * workers:
+                    batch, future = pending.popleft()
+                    count += self._merge_batch(batch, future.result())
+            while pending:
+                batch, future = pending.popleft()
+                count += self._merge_batch(batch, future.result())
+        return count
+
+    def add_documents_from(self, source, format="lines", workers=None, batch_size=1000,
+                           id_field="id", text_field="content", name=None):
+        # Documents stream from the file into fixed-size batches, so memory
+        # stays flat however large the corpus is. Lines read from a path or
+        # an open file are named after it unless another name is given.
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, encoding="utf-8") as lines:
+                return self.add_documents_from(lines, format, workers, batch_size, id_field, text_field,
+                                               os.fspath(source) if name is None else name)
+        if name is None:
+            name = getattr(source, "name", None)
+        documents = read_documents(source, format, id_field, text_field, name)
+        return self.add_documents(documents, workers, batch_size)
+
+    def _merge_batch(self, batch, segment):
+        with self.writing():
+            for doc_id, content in batch:
+                self.documents[doc_id] = content
+            self.indexer.merge(segment)
+        return len(batch)
+
+    def _cached(self, key, compute):
+        # Entries remember the index generation they were computed at, so an
+        # entry from before any later change to the index is never served.
+        indexer = self._reader()
+        generation = indexer.generation
+        cache = self.cache
+        with self.cache_lock:
+            entry = cache.get(key)
+            if entry is not None and entry[0] == generation:
+                cache.move_to_end(key)
+                self.cache_hits += 1
+                return list(entry[1])
+            self.cache_misses += 1
+        results = compute(indexer)
+        with self.cache_lock:
+            cache[key] = (generation, results)
+            cache.move_to_end(key)
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+                self.cache_evictions += 1
+        return list(results)
+
+    def cache_stats(self):
+        return {"hits": self.cache_hits, "misses": self.cache_misses,
+                "evictions": self.cache_evictions, "size": len(self.cache or ())}
+
+    def clear_cache(self):
+        if self.cache is not None:
+            with self.cache_lock:
+                self.cache.clear()
+        return True
+
+    def search(self, query, k=None):
+        if self.cache is not None:
+            key = ("search", tuple(self._terms(query)), k)
+            return self._cached(key, lambda indexer: self._search(query, k, indexer))
+        return self._search(query, k, self._reader())
+
+    def _search(self, query, k, indexer):
+        profiler = self.profiler
+        profile = None if profiler is None else profiler.begin(query)
         results = {}
-        words = query.lower().split()
+        words = self._terms(query)
+        if profile is not None:
+            profile.lap("tokenize")
         for word in words:
-            doc_ids = self.indexer.get_documents_with_word(word)
+            if len(word) > 1 and word.endswith("*"):
+                doc_ids = self._expand_prefix(word[:-1], indexer)
+            else:
+                doc_ids = indexer.get_documents_with_word(word)
+            if profile is not None:
+                profile.fetched(word, len(doc_ids))
             for doc_id in doc_ids:
                 if doc_id not in results:
                     results[doc_id] = 0
                 results[doc_id] += 1
-        return sorted(results.keys(), key=lambda k: results[k], reverse=True)
\ No newline at end of file
+            if profile is not None:
+                profile.lap("score")
+        if k is not None:
+            ranked = heapq.nlargest(k, results, key=results.__getitem__)
+        else:
+            ranked = sorted(results.keys(), key=lambda k: results[k], reverse=True)
+        if profile is not None:
+            profile.lap("sort")
+            profiler.finish(profile)
+        return ranked
+
+    def _terms(self, query):
+        if "*" not in query:
+            return self.tokenizer(query)
+        # Wildcards bypass the tokenizer, whose pattern may drop the "*".
+        terms = []
+        for word in query.split():
+            if len(word) > 1 and word.endswith("*"):
+                terms.append(self._fold(word))
+            else:
+                terms.extend(self.tokenizer(word))
+        return terms
+
+    def prefix_search(self, prefix, k=None):
+        return self.search(prefix + "*", k)
+
+    def complete(self, prefix, limit=10):
+        return self._reader().prefix_terms(self._fold(prefix), limit)
+
+    def _fold(self, word):
+        # Wildcard prefixes are case-folded like indexed terms when the
+        # tokenizer says how, and otherwise looked up as typed.
+        fold = getattr(self.tokenizer, "fold", None)
+        return word if fold is None else fold(word)
+
+    def _expand_prefix(self, prefix, indexer):
+        # A wildcard counts once per document however many of its terms
+        # match, with matches kept in indexing order.
+        postings = [list(indexer.get_documents_with_word(term)) for term in indexer.prefix_terms(prefix)]
+        if len(postings) == 1:
+            return postings[0]
+        return union(postings, indexer.ordinals.__getitem__)
+
+    def build_fuzzy(self, max_distance=2, background=False):
+        # Snapshots share the writer's FuzzyIndex, so building it once
+        # serves every reader.
+        return self.indexer.build_fuzzy(max_distance, background)
+
+    def fuzzy_search(self, query, max_distance=1, k=None):
+        # Each query word matches every term within max_distance edits and,
+        # like a wildcard, counts once per document.
+        indexer = self._reader()
+        key = indexer.ordinals.__getitem__
+        results = {}
+        for word in self.tokenizer(query):
+            postings = [list(indexer.get_documents_with_word(term))
+                        for _, term in indexer.fuzzy_terms(word, max_distance)]
+            for doc_id in union(postings, key):
+                results[doc_id] = results.get(doc_id, 0) + 1
+        if k is not None:
+            return heapq.nlargest(k, results, key=results.__getitem__)
+        return sorted(results, key=results.__getitem__, reverse=True)
+
+    def search_bm25(self, query, k=10):
+        if self.cache is not None:
+            key = ("bm25", tuple(self.tokenizer(query)), k)
+            return self._cached(key, lambda indexer: self._search_bm25(query, k, indexer))
+        return self._search_bm25(query, k, self._reader())
+
+    def _search_bm25(self, query, k, indexer):
+        scores = self.score_bm25(self.tokenizer(query), indexer=indexer)
+        return heapq.nlargest(k, scores, key=scores.__getitem__)
+
+    def score_bm25(self, words, doc_count=None, avg_length=None, doc_freqs=None, indexer=None):
+        # Corpus statistics can be passed in so that callers holding only part
+        # of the corpus still score documents as the whole corpus would.
+        if indexer is None:
+            indexer = self._reader()
+        if doc_count is None:
+            doc_count = indexer.document_count()
+        if avg_length is None:
+            avg_length = indexer.average_document_length()
+        k1 = self.k1
+        scores = {}
+        for word in dict.fromkeys(words):
+            postings = indexer.get_postings(word)
+            if not postings:
+                continue
+            df = doc_freqs[word] if doc_freqs is not None else len(postings)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for doc_id, tf, length in postings:
+                norm = k1 * (1 - self.b + self.b * length / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        return scores
+
+    def search_boolean(self, query):
+        # Terms are ANDed unless joined by OR; NOT negates the next operand,
+        # parentheses group, and double quotes mark a phrase. Results come
+        # back in indexing order.
+        tokens = QUERY_TOKEN.findall(query)
+        tokens.reverse()
+        if not tokens:
+            return []
+        result = self._parse_or(tokens)
+        if tokens:
+            raise ValueError("unexpected %r in query" % tokens[-1])
+        return self._evaluate(result, self._reader())
+
+    def _parse_or(self, tokens):
+        operands = [self._parse_and(tokens)]
+        while tokens and tokens[-1] == "OR":
+            tokens.pop()
+            operands.append(self._parse_and(tokens))
+        return ("or", operands) if len(operands) > 1 else operands[0]
+
+    def _parse_and(self, tokens):
+        operands = [self._parse_not(tokens)]
+        while tokens and tokens[-1] not in ("OR", ")"):
+            if tokens[-1] == "AND":
+                tokens.pop()
+            operands.append(self._parse_not(tokens))
+        return ("and", operands) if len(operands) > 1 else operands[0]
+
+    def _parse_not(self, tokens):
+        if tokens and tokens[-1] == "NOT":
+            tokens.pop()
+            return ("not", self._parse_not(tokens))
+        return self._parse_primary(tokens)
+
+    def _parse_primary(self, tokens):
+        if not tokens:
+            raise ValueError("query ends where a term was expected")
+        token = tokens.pop()
+        if token == "(":
+            node = self._parse_or(tokens)
+            if not tokens or tokens.pop() != ")":
+                raise ValueError("unbalanced parentheses in query")
+            return node
+        if token == ")":
+            raise ValueError("unbalanced parentheses in query")
+        if token.startswith('"'):
+            return ("phrase", self.tokenizer(token.strip('"')))
+        if len(token) > 1 and token.endswith("*"):
+            return ("term", self._fold(token))
+        terms = self.tokenizer(token)
+        if len(terms) == 1:
+            return ("term", terms[0])
+        # A token the tokenizer splits must match all of its parts; one it
+        # drops entirely (a stopword) matches nothing.
+        return ("and", [("term", term) for term in terms]) if terms else ("term", "")
+
+    def _evaluate(self, node, indexer):
+        kind, value = node
+        key = indexer.ordinals.__getitem__
+        if kind == "term":
+            if len(value) > 1 and value.endswith("*"):
+                return self._expand_prefix(value[:-1], indexer)
+            return list(indexer.get_documents_with_word(value))
+        if kind == "phrase":
+            return self._match_phrase(value, indexer)
+        if kind == "or":
+            return union([self._evaluate(operand, indexer) for operand in value], key)
+        if kind == "not":
+            return self._exclude(indexer.all_documents(), [value], indexer)
+
+        positive = [operand for operand in value if operand[0] != "not"]
+        negative = [operand[1] for operand in value if operand[0] == "not"]
+        if positive:
+            # Starting from the shortest posting list keeps every
+            # intermediate result as small as the most selective operand.
+            postings = sorted((self._evaluate(operand, indexer) for operand in positive), key=len)
+            result = postings[0]
+            for other in postings[1:]:
+                if not result:
+                    break
+                result = intersect(result, other, key)
+        else:
+            result = indexer.all_documents()
+        return self._exclude(result, negative, indexer)
+
+    def _exclude(self, result, operands, indexer):
+        for operand in operands:
+            if not result:
+                break
+            excluded = set(self._evaluate(operand, indexer))
+            result = [doc_id for doc_id in result if doc_id not in excluded]
+        return result
+
+    def _match_phrase(self, words, indexer):
+        if not words:
+            return []
+        if indexer.positions is None:
+            raise ValueError("phrase queries need an indexer built with positions=True")
+        key = indexer.ordinals.__getitem__
+        postings = sorted((list(indexer.get_documents_with_word(word)) for word in words), key=len)
+        candidates = postings[0]
+        for other in postings[1:]:
+            if not candidates:
+                return []
+            candidates = intersect(candidates, other, key)
+        result = []
+        for doc_id in candidates:
+            positions = indexer.positions[doc_id]
+            starts = set(positions[words[0]])
+            for offset, word in enumerate(words[1:], 1):
+                starts.intersection_update(position - offset for position in positions[word])
+                if not starts:
+                    break
+            if starts:
+                result.append(doc_id)
+        return result
@@ -0,0 +1,208 @@
+import heapq
+import multiprocessing
+import zlib
+from collections import defaultdict
+from itertools import islice
+
+from DocumentIndexer import DocumentIndexer
+from SearchEngine import SearchEngine
+from Tokenizer import Tokenizer
+
+
+def _rank_key(hit):
+    score, first_word, sequence, _ = hit
+    return -score, first_word, sequence
+
+
+def _first_word(indexer, doc_id, words):
+    freqs = indexer.term_freqs[doc_id]
+    for i, word in enumerate(words):
+        if word in freqs:
+            return i
+    return len(words)
+
+
+class _Shard:
+    # Runs inside a worker process and owns one slice of the corpus.
+    def __init__(self, positions, tokenizer):
+        self.engine = SearchEngine(DocumentIndexer(positions, tokenizer))
+        # Global insertion order of every document this shard has seen; it
+        # breaks ties exactly as ordinals do in a single SearchEngine.
+        self.sequence = {}
+
+    def add(self, documents):
+        for doc_id, content, sequence in documents:
+            self.sequence.setdefault(doc_id, sequence)
+            self.engine.add_document(doc_id, content)
+        return len(documents)
+
+    def update(self, doc_id, content, sequence):
+        self.sequence.setdefault(doc_id, sequence)
+        return self.engine.update_document(doc_id, content)
+
+    def delete(self, doc_id):
+        return self.engine.delete_document(doc_id)
+
+    def compact(self, max_docs):
+        return self.engine.compact(max_docs)
+
+    def search(self, words, k):
+        indexer = self.engine.indexer
+        scores = {}
+        first_words = {}
+        for i, word in enumerate(words):
+            for doc_id in indexer.get_documents_with_word(word):
+                if doc_id not in scores:
+                    scores[doc_id] = 0
+                    first_words[doc_id] = i
+                scores[doc_id] += 1
+        sequence = self.sequence
+        hits = [(score, first_words[doc_id], sequence[doc_id], doc_id) for doc_id, score in scores.items()]
+        if k is None:
+            return hits
+        return heapq.nsmallest(k, hits, key=_rank_key)
+
+    def stats(self, words):
+        indexer = self.engine.indexer
+        doc_freqs = {word: len(indexer.get_documents_with_word(word)) for word in words}
+        return indexer.document_count(), indexer.total_length, doc_freqs
+
+    def search_bm25(self, words, doc_count, avg_length, doc_freqs, k):
+        indexer = self.engine.indexer
+        scores = self.engine.score_bm25(words, doc_count, avg_length, doc_freqs)
+        # Scores are inserted in (first query word, ordinal) order, so the
+        # stable selection below already agrees with the global ranking.
+        top = heapq.nlargest(k, scores, key=scores.__getitem__)
+        return [(scores[doc_id], _first_word(indexer, doc_id, words), self.sequence[doc_id], doc_id)
+                for doc_id in top]
+
+
+def _serve(connection, positions, tokenizer):
+    shard = _Shard(positions, tokenizer)
+    while True:
+        command, args = connection.recv()
+        if command == "close":
+            connection.send((True, None))
+            return
+        try:
+            connection.send((True, getattr(shard, command)(*args)))
+        except Exception as exc:
+            connection.send((False, exc))
+
+
+class ShardedSearchEngine:
+    def __init__(self, shards=4, positions=False, tokenizer=None):
+        # Queries are tokenized here, documents inside the shards.
+        self.tokenizer = Tokenizer() if tokenizer is None else tokenizer
+        self.connections = []
+        self.processes = []
+        for _ in range(shards):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_serve, args=(child, positions, self.tokenizer), daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+        self.next_sequence = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close", ()))
+        for connection, process in zip(self.connections, self.processes):
+            connection.recv()
+            connection.close()
+            process.join()
+        self.connections = []
+        self.processes = []
+        return True
+
+    def shard_for(self, doc_id):
+        # crc32 rather than hash() keeps placement stable across runs.
+        return zlib.crc32(repr(doc_id).encode("utf-8")) % len(self.connections)
+
+    def _receive(self, connection):
+        ok, result = connection.recv()
+        if not ok:
+            raise result
+        return result
+
+    def _gather(self, connections):
+        # Every reply is read before any error is raised, so no shard is left
+        # with an answer that the next request would mistake for its own.
+        replies = [connection.recv() for connection in connections]
+        for ok, result in replies:
+            if not ok:
+                raise result
+        return [result for _, result in replies]
+
+    def _call(self, shard, command, *args):
+        connection = self.connections[shard]
+        connection.send((command, args))
+        return self._receive(connection)
+
+    def _broadcast(self, command, *args):
+        # Every shard is asked before any answer is read, so shards work on
+        # the request in parallel.
+        for connection in self.connections:
+            connection.send((command, args))
+        return self._gather(self.connections)
+
+    def _sequence(self):
+        self.next_sequence += 1
+        return self.next_sequence
+
+    def add_document(self, doc_id, content):
+        self._call(self.shard_for(doc_id), "add", [(doc_id, content, self._sequence())])
+        return True
+
+    def add_documents(self, documents, batch_size=1000):
+        documents = iter(documents)
+        count = 0
+        for batch in iter(lambda: list(islice(documents, batch_size)), []):
+            routed = defaultdict(list)
+            for doc_id, content in batch:
+                routed[self.shard_for(doc_id)].append((doc_id, content, self._sequence()))
+            for shard, shard_batch in routed.items():
+                self.connections[shard].send(("add", (shard_batch,)))
+            count += sum(self._gather([self.connections[shard] for shard in routed]))
+        return count
+
+    def update_document(self, doc_id, content):
+        return self._call(self.shard_for(doc_id), "update", doc_id, content, self._sequence())
+
+    def delete_document(self, doc_id):
+        return self._call(self.shard_for(doc_id), "delete", doc_id)
+
+    def compact(self, max_docs=None):
+        return sum(self._broadcast("compact", max_docs))
+
+    def search(self, query, k=None):
+        words = self.tokenizer(query)
+        hits = [hit for shard_hits in self._broadcast("search", words, k) for hit in shard_hits]
+        if k is None:
+            hits.sort(key=_rank_key)
+        else:
+            hits = heapq.nsmallest(k, hits, key=_rank_key)
+        return [hit[3] for hit in hits]
+
+    def search_bm25(self, query, k=10):
+        words = list(dict.fromkeys(self.tokenizer(query)))
+        # First gather corpus statistics so every shard scores against the
+        # whole corpus rather than its own slice of it.
+        doc_count = total_length = 0
+        doc_freqs = dict.fromkeys(words, 0)
+        for shard_count, shard_length, shard_freqs in self._broadcast("stats", words):
+            doc_count += shard_count
+            total_length += shard_length
+            for word, df in shard_freqs.items():
+                doc_freqs[word] += df
+        avg_length = total_length / doc_count if doc_count else 0.0
+        hits = [hit for shard_hits in self._broadcast("search_bm25", words, doc_count, avg_length, doc_freqs, k)
+                for hit in shard_hits]
+        return [hit[3] for hit in heapq.nsmallest(k, hits, key=_rank_key)]
@@ -0,0 +1,116 @@
+import importlib
+import re
+import sys
+
+ENGLISH_STOPWORDS = frozenset(
+    "a an and are as at be but by for if in into is it no not of on or such that the their "
+    "then there these they this to was will with".split()
+)
+
+SUFFIXES = ("ational", "ization", "fulness", "ousness", "iveness", "ations", "ation", "ness",
+            "ment", "ings", "ing", "ies", "ied", "edly", "ed", "ly", "es", "s")
+
+
+def strip_suffixes(word):
+    # A deliberately small suffix stripper; any picklable callable taking
+    # and returning a term can be used as a stemmer instead.
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+class Tokenizer:
+    # The default pattern keeps the historical lower().split() behaviour;
+    # r"\w+" splits punctuation off words.
+    def __init__(self, pattern=r"\S+", lowercase=True, stopwords=None, stemmer=None, intern=True):
+        self.pattern = re.compile(pattern)
+        # str.split() finds the same tokens as r"\S+" several times faster.
+        self.split = pattern == r"\S+"
+        self.lowercase = lowercase
+        self.stopwords = frozenset(stopwords) if stopwords else None
+        self.stemmer = stemmer
+        self.intern = intern
+        self.stems = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["stems"] = {}
+        return state
+
+    def fold(self, word):
+        # Case-folds a word as tokenizing would, without splitting, stopwords
+        # or stemming; for wildcard prefixes.
+        return word.lower() if self.lowercase else word
+
+    def __call__(self, text):
+        if self.lowercase:
+            text = text.lower()
+        tokens = text.split() if self.split else self.pattern.findall(text)
+        if self.stopwords is not None:
+            stopwords = self.stopwords
+            tokens = [token for token in tokens if token not in stopwords]
+        if self.stemmer is not None:
+            stems = self.stems
+            stemmer = self.stemmer
+            # Stems are memoised, so each distinct word is stemmed only once.
+            result = []
+            for token in tokens:
+                stem = stems.get(token)
+                if stem is None:
+                    stem = stems[token] = sys.intern(stemmer(token))
+                result.append(stem)
+            return result
+        if self.intern:
+            return list(map(sys.intern, tokens))
+        return tokens
+
+
+def _resolve(reference):
+    module, _, name = reference.partition(":")
+    try:
+        found = importlib.import_module(module)
+        for part in name.split("."):
+            found = getattr(found, part)
+    except (ImportError, AttributeError):
+        return None
+    return found
+
+
+def _reference(function):
+    # "module:qualname" for a callable that importing can find again, so
+    # lambdas, closures and instances get None.
+    reference = "%s:%s" % (getattr(function, "__module__", None), getattr(function, "__qualname__", None))
+    return reference if _resolve(reference) is function else None
+
+
+def describe(tokenizer):
+    # A JSON-serialisable description restore() rebuilds the tokenizer
+    # from, or None if it cannot be rebuilt.
+    if type(tokenizer) is Tokenizer:
+        stemmer = None
+        if tokenizer.stemmer is not None:
+            stemmer = _reference(tokenizer.stemmer)
+            if stemmer is None:
+                return None
+        stopwords = None if tokenizer.stopwords is None else sorted(tokenizer.stopwords)
+        return {"pattern": tokenizer.pattern.pattern, "lowercase": tokenizer.lowercase,
+                "stopwords": stopwords, "stemmer": stemmer, "intern": tokenizer.intern}
+    reference = _reference(tokenizer)
+    return None if reference is None else {"callable": reference}
+
+
+def restore(description):
+    # The tokenizer describe() gave description for, or None if there was
+    # none or a callable it names can no longer be imported.
+    if description is None:
+        return None
+    if "callable" in description:
+        return _resolve(description["callable"])
+    stemmer = description["stemmer"]
+    if stemmer is not None:
+        stemmer = _resolve(stemmer)
+        if stemmer is None:
+            return None
+    return Tokenizer(description["pattern"], description["lowercase"], description["stopwords"],
+                     stemmer, description["intern"])
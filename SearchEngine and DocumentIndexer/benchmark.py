@@ -0,0 +1,298 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import accumulate, islice
+
+from DiskIndex import DiskIndex
+from DocumentIndexer import DocumentIndexer
+from SearchEngine import SearchEngine
+from ShardedSearchEngine import ShardedSearchEngine
+from Tokenizer import ENGLISH_STOPWORDS, Tokenizer, strip_suffixes
+
+VOCABULARY = ["word%d" % i for i in range(5000)]
+
+
+def make_corpus(num_docs, words_per_doc=20, seed=0):
+    rng = random.Random(seed)
+    # A handful of very common words makes every document touch long postings.
+    common = ["the", "of", "and", "to", "a"]
+    for i in range(num_docs):
+        words = rng.choices(VOCABULARY, k=words_per_doc - len(common)) + common
+        yield "doc%d" % i, " ".join(words)
+
+
+def bench_indexing(sizes=(1000, 10000, 100000)):
+    for size in sizes:
+        corpus = list(make_corpus(size))
+        indexer = DocumentIndexer()
+        start = time.perf_counter()
+        for doc_id, content in corpus:
+            indexer.add_document(doc_id, content)
+        indexer.freeze()
+        elapsed = time.perf_counter() - start
+        print("index %8d docs: %8.3fs  %10.0f docs/s" % (size, elapsed, size / elapsed))
+
+
+def bench_bulk_indexing(size=200000, workers=(1, 2, 4, 8)):
+    corpus = list(make_corpus(size))
+    for count in workers:
+        engine = SearchEngine(DocumentIndexer())
+        start = time.perf_counter()
+        engine.add_documents(corpus, workers=count, batch_size=5000)
+        elapsed = time.perf_counter() - start
+        print("bulk %8d docs, %d workers: %8.3fs  %10.0f docs/s" % (size, count, elapsed, size / elapsed))
+
+
+def bench_reopen(size=100000):
+    indexer = DocumentIndexer()
+    for doc_id, content in make_corpus(size):
+        indexer.add_document(doc_id, content)
+    path = os.path.join(tempfile.mkdtemp(), "index.idx")
+    start = time.perf_counter()
+    indexer.save(path)
+    saved = time.perf_counter() - start
+    start = time.perf_counter()
+    index = DiskIndex(path)
+    opened = time.perf_counter() - start
+    start = time.perf_counter()
+    index.get_documents_with_word("word42")
+    queried = time.perf_counter() - start
+    index.close()
+    print("disk %8d docs: save %.3fs  open %.3fms  first lookup %.3fms"
+          % (size, saved, opened * 1000, queried * 1000))
+
+
+def _traced(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, memory
+
+
+def bench_compressed_postings(size=100000, queries=200):
+    indexer = DocumentIndexer()
+    for doc_id, content in make_corpus(size):
+        indexer.add_document(doc_id, content)
+    engine = SearchEngine(indexer)
+    rng = random.Random(1)
+    query_list = [" ".join(rng.choices(VOCABULARY, k=2) + ["the"]) for _ in range(queries)]
+    lists = indexer.index
+    for layout in ("list", "compressed"):
+        # Both layouts are rebuilt under tracemalloc so only postings count.
+        indexer.index = dict(lists)
+        if layout == "list":
+            _, memory = _traced(lambda: {word: list(postings) for word, postings in lists.items()})
+        else:
+            _, memory = _traced(indexer.compress)
+        start = time.perf_counter()
+        for query in query_list:
+            engine.search(query, k=10)
+        elapsed = time.perf_counter() - start
+        print("postings %-10s %8d docs: %8.1f MiB  %8.3fms/query"
+              % (layout, size, memory / 2 ** 20, elapsed * 1000 / queries))
+
+
+def bench_sharded_search(size=100000, shards=(1, 2, 4), queries=200):
+    rng = random.Random(2)
+    query_list = [" ".join(rng.choices(VOCABULARY, k=3)) for _ in range(queries)]
+    for count in shards:
+        with ShardedSearchEngine(count) as engine:
+            engine.add_documents(make_corpus(size), batch_size=5000)
+            start = time.perf_counter()
+            for query in query_list:
+                engine.search_bm25(query, k=10)
+            elapsed = time.perf_counter() - start
+        print("sharded %8d docs, %d shards: %8.3fms/query" % (size, count, elapsed * 1000 / queries))
+
+
+def bench_fuzzy_terms(vocabulary=1000000, queries=("searching", "python", "indexer"), distances=(1, 2)):
+    rng = random.Random(3)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    indexer = DocumentIndexer()
+    for term in {"".join(rng.choices(letters, k=rng.randrange(4, 12))) for _ in range(vocabulary)}:
+        indexer.index[term] = ["doc"]
+        indexer.new_terms.append(term)
+        indexer.term_history.append(term)
+    for distance in distances:
+        start = time.perf_counter()
+        indexer.build_fuzzy(distance)
+        print("fuzzy %8d terms, d=%d index built in %.1fs"
+              % (len(indexer.index), distance, time.perf_counter() - start))
+        for query in queries:
+            start = time.perf_counter()
+            matches = indexer.fuzzy_terms(query, distance)
+            elapsed = time.perf_counter() - start
+            print("fuzzy %8d terms, %-10s d=%d: %4d matches %8.1fms"
+                  % (len(indexer.index), query, distance, len(matches), elapsed * 1000))
+
+
+def bench_tokenizer(size=100000):
+    corpus = [content for _, content in make_corpus(size)]
+    tokenizers = [
+        ("split", None),
+        ("default", Tokenizer()),
+        ("no intern", Tokenizer(intern=False)),
+        ("\\w+ stop+stem", Tokenizer(r"\w+", stopwords=ENGLISH_STOPWORDS, stemmer=strip_suffixes)),
+    ]
+    for name, tokenizer in tokenizers:
+        tokenize = tokenizer or (lambda text: text.lower().split())
+        start = time.perf_counter()
+        count = sum(len(tokenize(content)) for content in corpus)
+        elapsed = time.perf_counter() - start
+        # Keeping every token list alive shows what interning saves.
+        _, memory = _traced(lambda: [tokenize(content) for content in corpus])
+        print("tokenize %-16s %10.0f tokens/s  %8.1fMB held"
+              % (name, count / elapsed, memory / 1e6))
+
+
+class ZipfSampler:
+    # Draws term ranks with probability proportional to 1 / rank**exponent,
+    # which is how word frequencies fall off in natural text.
+    def __init__(self, vocabulary_size, exponent=1.1, seed=0):
+        self.rng = random.Random(seed)
+        self.terms = ["t%d" % rank for rank in range(vocabulary_size)]
+        weights = [1 / rank ** exponent for rank in range(1, vocabulary_size + 1)]
+        self.cum_weights = list(accumulate(weights))
+
+    def sample(self, k):
+        return self.rng.choices(self.terms, cum_weights=self.cum_weights, k=k)
+
+
+def make_zipf_corpus(num_docs, mean_length=50, vocabulary_size=100000, exponent=1.1, seed=0):
+    sampler = ZipfSampler(vocabulary_size, exponent, seed)
+    rng = random.Random(seed + 1)
+    for i in range(num_docs):
+        length = max(1, int(rng.expovariate(1 / mean_length)))
+        yield "doc%d" % i, " ".join(sampler.sample(length))
+
+
+def _rss():
+    # Current resident set size in bytes; falls back to the peak where
+    # /proc is missing, which still bounds the index from above.
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def _percentiles(latencies):
+    latencies = sorted(latencies)
+    pick = lambda p: latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+    return {"p50": pick(50) * 1000, "p90": pick(90) * 1000, "p99": pick(99) * 1000,
+            "mean": sum(latencies) / len(latencies) * 1000}
+
+
+def bench_zipf(num_docs, query_lengths=(1, 2, 5), queries=200, k=10, mean_length=50,
+               vocabulary_size=100000, exponent=1.1, seed=0):
+    # The corpus is generated a batch at a time outside the timed region,
+    # so neither generation nor the whole text skews the numbers.
+    gc.collect()
+    before = _rss()
+    engine = SearchEngine(DocumentIndexer(), store="none")
+    corpus = make_zipf_corpus(num_docs, mean_length, vocabulary_size, exponent, seed)
+    elapsed = 0.0
+    for batch in iter(lambda: list(islice(corpus, 10000)), []):
+        start = time.perf_counter()
+        for doc_id, content in batch:
+            engine.add_document(doc_id, content)
+        elapsed += time.perf_counter() - start
+    batch = None
+    gc.collect()
+    memory = _rss() - before
+    tokens = engine.indexer.total_length
+
+    # Queries draw from the same distribution as documents, so frequent
+    # terms with long postings dominate just as they would in practice.
+    sampler = ZipfSampler(vocabulary_size, exponent, seed + 2)
+    latency = {}
+    for method in ("search", "search_bm25"):
+        run = getattr(engine, method)
+        latency[method] = {}
+        for length in query_lengths:
+            timings = []
+            for _ in range(queries):
+                query = " ".join(sampler.sample(length))
+                began = time.perf_counter()
+                run(query, k)
+                timings.append(time.perf_counter() - began)
+            latency[method][str(length)] = _percentiles(timings)
+    return {
+        "docs": num_docs,
+        "tokens": tokens,
+        "terms": len(engine.indexer.index),
+        "index_seconds": elapsed,
+        "docs_per_second": num_docs / elapsed,
+        "memory_bytes": memory,
+        "memory_per_doc": memory / num_docs,
+        "latency_ms": latency,
+    }
+
+
+def run_suite(sizes=(10000, 100000, 1000000), output=None, **options):
+    results = []
+    for size in sizes:
+        result = bench_zipf(size, **options)
+        results.append(result)
+        print("zipf %9d docs: %9.0f docs/s %7.0f B/doc" % (size, result["docs_per_second"], result["memory_per_doc"]))
+        for method, by_length in result["latency_ms"].items():
+            for length, stats in by_length.items():
+                print("    %-11s %s terms: p50 %7.3fms  p90 %7.3fms  p99 %7.3fms"
+                      % (method, length, stats["p50"], stats["p90"], stats["p99"]))
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "options": options,
+        },
+        "results": results,
+    }
+    if output is not None:
+        with open(output, "w") as out:
+            json.dump(report, out, indent=2)
+    return report
+
+
+def run_all():
+    bench_indexing()
+    bench_bulk_indexing()
+    bench_reopen()
+    bench_compressed_postings()
+    bench_sharded_search()
+    bench_fuzzy_terms()
+    bench_tokenizer()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for DocumentIndexer and SearchEngine.")
+    parser.add_argument("--zipf", action="store_true",
+                        help="run only the Zipfian suite instead of every micro-benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="corpus sizes in documents (up to 10M needs several GB of memory)")
+    parser.add_argument("--queries", type=int, default=200, help="queries per query length")
+    parser.add_argument("--query-lengths", type=int, nargs="+", default=[1, 2, 5])
+    parser.add_argument("--mean-length", type=int, default=50, help="mean document length in tokens")
+    parser.add_argument("--vocabulary", type=int, default=100000)
+    parser.add_argument("--exponent", type=float, default=1.1, help="Zipf exponent")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the Zipfian results as JSON to this file")
+    args = parser.parse_args()
+    if not args.zipf:
+        run_all()
+    run_suite(args.sizes, args.output, query_lengths=tuple(args.query_lengths), queries=args.queries,
+              mean_length=args.mean_length, vocabulary_size=args.vocabulary,
+              exponent=args.exponent, seed=args.seed)
@@ -0,0 +1,57 @@
+import pytest
+
+from DiskIndex import DiskIndex
+from DocumentIndexer import DocumentIndexer
+from SearchEngine import SearchEngine
+from Tokenizer import Tokenizer, strip_suffixes
+
+DOCUMENTS = [(1, "Dogs were running home"), (2, "The dog runs"), (3, "cats sleeping")]
+
+
+def save(tmp_path, indexer):
+    for doc_id, content in DOCUMENTS:
+        indexer.add_document(doc_id, content)
+    path = str(tmp_path / "index.idx")
+    indexer.save(path)
+    return indexer, path
+
+
+def test_reopened_index_answers_like_the_indexer(tmp_path):
+    indexer, path = save(tmp_path, DocumentIndexer())
+    indexer.update_document(2, "the dog sleeping")
+    indexer.delete_document(3)
+    indexer.save(path)
+    with DiskIndex(path) as index:
+        memory, disk = SearchEngine(indexer), SearchEngine(index)
+        for query in ["dog", "dogs sleeping", "the", "cats"]:
+            assert disk.search(query) == memory.search(query)
+            assert disk.search_bm25(query) == memory.search_bm25(query)
+        assert disk.search_boolean("sleeping OR dogs NOT home") == [2]
+        assert disk.search_boolean("do*") == [1, 2]
+        assert disk.complete("d") == ["dog", "dogs"]
+        assert index.all_documents() == [1, 2]
+        assert index.get_postings("dog") == [(2, 1, 3)]
+
+
+def test_reopened_index_tokenizes_queries_as_it_was_built(tmp_path):
+    tokenizer = Tokenizer(r"\w+", stemmer=strip_suffixes)
+    _, path = save(tmp_path, DocumentIndexer(tokenizer=tokenizer))
+    with DiskIndex(path) as index:
+        engine = SearchEngine(index)
+        assert engine.search("running") == [1]
+        assert engine.search("dogs") == [1, 2]
+
+
+def test_unknown_tokenizer_is_refused_unless_given(tmp_path):
+    _, path = save(tmp_path, DocumentIndexer(tokenizer=lambda text: text.lower().split()))
+    with pytest.raises(ValueError, match="tokenizer"):
+        DiskIndex(path)
+    with DiskIndex(path, tokenizer=str.split) as index:
+        assert SearchEngine(index).search("dogs") == [1]
+
+
+def test_disk_index_is_read_only(tmp_path):
+    _, path = save(tmp_path, DocumentIndexer())
+    with DiskIndex(path) as index:
+        with pytest.raises(TypeError):
+            index.add_document(4, "new")
@@ -0,0 +1,98 @@
+import DocumentIndexer as document_indexer
+from DocumentIndexer import DocumentIndexer
+from SearchEngine import SearchEngine
+
+
+def make_indexer(**documents):
+    indexer = DocumentIndexer()
+    for doc_id, content in documents.items():
+        indexer.add_document(doc_id, content)
+    return indexer
+
+
+def test_update_replaces_the_words_of_a_document():
+    indexer = make_indexer(a="red fish", b="blue fish")
+    indexer.update_document("a", "green fish")
+    assert indexer.get_documents_with_word("red") == []
+    assert indexer.get_documents_with_word("green") == ["a"]
+    assert indexer.get_documents_with_word("fish") == ["a", "b"]
+    assert indexer.get_postings("green") == [("a", 1, 2)]
+    assert SearchEngine(indexer).search("red") == []
+
+
+def test_update_keeps_the_document_in_indexing_order():
+    indexer = make_indexer(a="one", b="two", c="three")
+    indexer.update_document("a", "two")
+    assert indexer.get_documents_with_word("two") == ["a", "b"]
+
+
+def test_update_can_bring_back_a_word_it_removed():
+    indexer = make_indexer(a="red fish")
+    indexer.update_document("a", "fish")
+    indexer.update_document("a", "red fish")
+    assert indexer.get_documents_with_word("red") == ["a"]
+    assert indexer.prefix_terms("r") == ["red"]
+
+
+def test_delete_hides_the_document_before_compact():
+    indexer = make_indexer(a="red fish", b="blue fish")
+    assert indexer.delete_document("a")
+    assert not indexer.delete_document("a")
+    assert indexer.get_documents_with_word("fish") == ["b"]
+    assert indexer.get_documents_with_word("red") == []
+    assert indexer.prefix_terms("") == ["blue", "fish"]
+    assert indexer.document_count() == 1
+    assert indexer.all_documents() == ["b"]
+    assert indexer.average_document_length() == 2
+
+
+def test_compact_removes_stale_postings_a_few_documents_at_a_time():
+    indexer = make_indexer(a="red fish", b="blue fish", c="red cat")
+    indexer.delete_document("a")
+    indexer.delete_document("c")
+    assert indexer.compact(max_docs=1) == 1
+    assert indexer.compact() == 1
+    assert indexer.compact() == 0
+    assert indexer.index == {"blue": ["b"], "fish": ["b"]}
+    assert indexer.stale == {}
+    assert indexer.prefix_terms("") == ["blue", "fish"]
+    assert indexer.fuzzy_terms("rad", 1) == []
+
+
+def test_words_compacted_away_can_be_indexed_again():
+    indexer = make_indexer(a="red")
+    indexer.delete_document("a")
+    indexer.compact()
+    indexer.add_document("b", "red")
+    assert indexer.get_documents_with_word("red") == ["b"]
+    assert indexer.prefix_terms("") == ["red"]
+
+
+def test_prefix_terms_see_new_words_before_and_after_the_runs_merge(monkeypatch):
+    monkeypatch.setattr(document_indexer, "RECENT_TERMS", 4)
+    indexer = DocumentIndexer()
+    expected = []
+    for i in range(50):
+        word = "w%02d" % (49 - i)
+        indexer.add_document(i, word)
+        expected.append(word)
+        if i % 7 == 0:
+            indexer.delete_document(i)
+            indexer.compact()
+            expected.remove(word)
+        assert indexer.prefix_terms("w") == sorted(expected)
+        assert indexer.prefix_terms("w", limit=3) == sorted(expected)[:3]
+    terms, recent = indexer.term_runs()
+    assert terms and len(recent) <= 4 + len(terms) // 32
+
+
+def test_distance_two_fuzzy_terms_match_before_and_after_the_map_is_built():
+    indexer = make_indexer(a="search searching", b="starch serum", c="research")
+    indexer.delete_document("c")
+    before = indexer.fuzzy_terms("serch", 2)
+    assert before == [(1, "search"), (2, "serum"), (2, "starch")]
+    indexer.build_fuzzy()
+    assert indexer.fuzzy.deletions is not None
+    assert indexer.fuzzy_terms("serch", 2) == before
+    indexer.add_document("d", "serge")
+    assert indexer.fuzzy_terms("serch", 2) == sorted(before + [(2, "serge")])
@@ -0,0 +1,60 @@
+import pytest
+
+from DocumentIndexer import DocumentIndexer
+from SearchEngine import SearchEngine
+
+DOCUMENTS = [
+    ("a", "the quick brown fox"),
+    ("b", "the lazy brown dog"),
+    ("c", "quick thinking dog"),
+    ("d", "a fox and a dog"),
+]
+
+
+@pytest.fixture
+def engine():
+    engine = SearchEngine(DocumentIndexer(positions=True))
+    engine.add_documents(DOCUMENTS)
+    return engine
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("brown dog", ["b"]),
+    ("brown AND dog", ["b"]),
+    ("fox OR lazy", ["a", "b", "d"]),
+    ("dog NOT brown", ["c", "d"]),
+    ("NOT dog", ["a"]),
+    ("(fox OR lazy) AND dog", ["b", "d"]),
+    ("quick (fox OR dog)", ["a", "c"]),
+    ("NOT (fox OR lazy)", ["c"]),
+    ('"brown fox"', ["a"]),
+    ('"fox brown"', []),
+    ('"brown dog" OR thinking', ["b", "c"]),
+    ("qu* dog", ["c"]),
+    ("Quick", ["a", "c"]),
+    ("missing", []),
+])
+def test_boolean_queries(engine, query, expected):
+    assert engine.search_boolean(query) == expected
+
+
+@pytest.mark.parametrize("query", ["(fox", "fox)", "fox OR", "NOT"])
+def test_malformed_queries_are_rejected(engine, query):
+    with pytest.raises(ValueError):
+        engine.search_boolean(query)
+
+
+def test_boolean_queries_follow_updates_and_deletes(engine):
+    engine.update_document("a", "slow brown fox")
+    engine.delete_document("d")
+    assert engine.search_boolean("fox NOT quick") == ["a"]
+    assert engine.search_boolean("dog") == ["b", "c"]
+    engine.compact()
+    assert engine.search_boolean("dog OR fox") == ["a", "b", "c"]
+
+
+def test_phrases_need_positions():
+    engine = SearchEngine(DocumentIndexer())
+    engine.add_documents(DOCUMENTS)
+    with pytest.raises(ValueError):
+        engine.search_boolean('"brown fox"')
@@ -0,0 +1,92 @@
+import random
+import threading
+
+from DocumentIndexer import DocumentIndexer
+from SearchEngine import SearchEngine
+
+WORDS = ["word%d" % i for i in range(50)]
+
+
+def state(indexer, words):
+    return {word: (list(indexer.get_documents_with_word(word)), indexer._has_live_postings(word))
+            for word in words}
+
+
+def test_readers_never_see_a_half_applied_write():
+    # Every document holds both "alpha" and "omega", so a reader that ever
+    # sees one without the other has observed a half-indexed document.
+    engine = SearchEngine(DocumentIndexer(positions=True), concurrent=True)
+    engine.add_documents(("seed%d" % i, "alpha omega seed") for i in range(1000))
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            snapshot = engine._reader()
+            alpha = snapshot.get_documents_with_word("alpha")
+            omega = snapshot.get_documents_with_word("omega")
+            if list(alpha) != list(omega) or len(alpha) != snapshot.document_count():
+                errors.append("snapshot with %d alpha / %d omega / %d docs"
+                              % (len(alpha), len(omega), snapshot.document_count()))
+            if engine.search_boolean("alpha NOT omega") or engine.search_boolean("omega NOT alpha"):
+                errors.append("boolean search saw a half-indexed document")
+
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for i in range(2000):
+            if i % 10 == 9:
+                engine.delete_document("doc%d" % (i - 5))
+            elif i % 10 == 8:
+                engine.update_document("doc%d" % (i - 3), "omega rewritten alpha %d" % i)
+            else:
+                engine.add_document("doc%d" % i, "alpha %s omega" % " ".join(WORDS[i % 45:i % 45 + 5]))
+            if i % 100 == 99:
+                engine.compact()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert not errors, errors[:10]
+
+
+def test_snapshots_keep_their_view_of_a_document_added_and_deleted_since():
+    indexer = DocumentIndexer()
+    indexer.add_document("a", "shared")
+    first = indexer.snapshot()
+    indexer.add_document("b", "shared")
+    indexer.delete_document("b")
+    second = indexer.snapshot()
+    indexer.compact()
+    assert first.get_documents_with_word("shared") == ["a"]
+    assert second.get_documents_with_word("shared") == ["a"]
+    assert second.prefix_terms("sh") == ["shared"]
+    assert indexer.snapshot().get_documents_with_word("shared") == ["a"]
+
+
+def test_old_snapshots_never_change():
+    rng = random.Random(0)
+    words = WORDS[:8]
+    indexer = DocumentIndexer(positions=True)
+    snapshots = []
+    for _ in range(2000):
+        doc_id = "doc%d" % rng.randrange(20)
+        content = " ".join(rng.choices(words, k=rng.randrange(1, 4)))
+        action = rng.random()
+        if action < 0.5:
+            indexer.add_document(doc_id, content)
+        elif action < 0.7:
+            indexer.update_document(doc_id, content)
+        elif action < 0.85:
+            indexer.delete_document(doc_id)
+        else:
+            indexer.compact(rng.choice([None, 1]))
+        if rng.random() < 0.3:
+            expected = state(indexer, words)
+            snapshot = indexer.snapshot()
+            assert state(snapshot, words) == expected
+            snapshots.append((snapshot, expected, indexer.prefix_terms("word")))
+    for snapshot, expected, terms in snapshots:
+        assert state(snapshot, words) == expected
+        assert snapshot.prefix_terms("word") == terms